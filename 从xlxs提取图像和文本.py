@@ -1,5 +1,169 @@
 import os
+import io
+import sys
+import argparse
+import json
+import time
+import zlib
+import struct
+import shutil
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from PIL import Image, PngImagePlugin
 from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+# 定义一个函数，用流式只读模式一次遍历所有行，同时写出每个文本列的文件
+def extract_text_columns(file_path, sheet_name, text_cols, start_row, output_dir, verbose=True):
+    # read_only=True 为流式读取：按行解析XML，不会把整个工作表放进内存
+    # data_only=True 表示只加载单元格的显示值，而不是公式。
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        # 检查用户输入的工作表名称是否存在
+        if sheet_name not in wb.sheetnames:
+            print("可用的工作表：", wb.sheetnames) # 提示用户所有可用的工作表名称
+            raise ValueError(f'工作表 {sheet_name} 不存在') # 抛出错误，终止程序
+        ws = wb[sheet_name]
+        # 只读模式默认按文件里记录的尺寸(<dimension>)截断行列，这个记录常常不准，改为读到最后一行
+        ws.reset_dimensions()
+
+        # 把列字母转换成行元组中的下标，例如 'D' -> 3
+        col_indexes = {col: column_index_from_string(col) - 1 for col in text_cols}
+        max_col = max(col_indexes.values()) + 1
+
+        # ExitStack 负责在结束（或出错）时关闭所有同时打开的文本文件
+        with ExitStack() as stack:
+            # 每个文本列对应一个文件，例如 'output/D.txt'
+            # 'utf-8-sig' 可以保证在Windows记事本中打开txt文件时不会出现乱码。
+            files = {
+                col: stack.enter_context(open(os.path.join(output_dir, f"{col}.txt"), 'w', encoding='utf-8-sig'))
+                for col in text_cols
+            }
+
+            # 只遍历一次：每读到一行，就把各列的值分别写入各自的文件
+            # values_only=True 直接返回值，不创建单元格对象
+            rows = 0
+            for row in ws.iter_rows(min_row=start_row, max_col=max_col, values_only=True):
+                rows += 1
+                for col, index in col_indexes.items():
+                    # 行尾的空单元格可能不在元组中
+                    val = row[index] if index < len(row) else None
+                    # 如果单元格有值（不是 None），则写入文件，并在末尾添加一个换行符
+                    if val is not None:
+                        files[col].write(str(val) + "\n")
+
+        written = 0
+        for col in text_cols:
+            txt_path = os.path.join(output_dir, f"{col}.txt")
+            written += os.path.getsize(txt_path)
+            if verbose:
+                print(f"文本列 {col} 已保存到: {txt_path}") # 打印提示信息
+        # 返回处理的行数和写入的字节数
+        return rows, written
+    finally:
+        # 只读模式会一直占用文件句柄，必须手动关闭
+        wb.close()
+
+# xlsx 本质是一个zip压缩包，下面这些是其中XML用到的命名空间
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+NS_XDR = 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing'
+NS_A = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+# 以单元格为锚点的两种图片锚点（absoluteAnchor 没有单元格位置，忽略）
+CELL_ANCHORS = {f'{{{NS_XDR}}}twoCellAnchor', f'{{{NS_XDR}}}oneCellAnchor'}
+
+# 把关系文件中的目标路径解析为压缩包内的完整路径
+def resolve_part_path(source_part, target):
+    # 以 / 开头的是相对于压缩包根目录的绝对路径
+    if target.startswith('/'):
+        return target.lstrip('/')
+    # 其余是相对于源文件所在目录的路径，例如 '../media/image1.png'
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+# 读取某个部件的关系文件，例如 xl/drawings/_rels/drawing1.xml.rels，返回 {rId: (类型, 目标路径)}
+def read_relationships(zf, part_path):
+    rels_path = posixpath.join(posixpath.dirname(part_path), '_rels', posixpath.basename(part_path) + '.rels')
+    try:
+        root = ET.fromstring(zf.read(rels_path))
+    except KeyError:
+        # 没有关系文件，说明这个部件不引用其他内容
+        return {}
+    return {
+        rel.get('Id'): (rel.get('Type', ''), resolve_part_path(part_path, rel.get('Target', '')))
+        for rel in root.iter(f'{{{NS_PKG_REL}}}Relationship')
+        # 外部链接的图片不在压缩包里
+        if rel.get('TargetMode') != 'External'
+    }
+
+# 根据工作表名称找到对应的XML部件，例如 '数据' -> 'xl/worksheets/sheet1.xml'
+def find_sheet_part(zf, sheet_name):
+    workbook_rels = read_relationships(zf, 'xl/workbook.xml')
+    root = ET.fromstring(zf.read('xl/workbook.xml'))
+    sheets = {sheet.get('name'): sheet.get(f'{{{NS_REL}}}id') for sheet in root.iter(f'{{{NS_MAIN}}}sheet')}
+    if sheet_name not in sheets:
+        print("可用的工作表：", list(sheets)) # 提示用户所有可用的工作表名称
+        raise ValueError(f'工作表 {sheet_name} 不存在') # 抛出错误，终止程序
+    return workbook_rels[sheets[sheet_name]][1]
+
+# 建立 (行号, 列字母) -> [压缩包内图片路径] 的索引，只解析绘图XML，不读取图片数据
+def build_image_index(zf, sheet_part):
+    index = {}
+    for rel_type, drawing_part in read_relationships(zf, sheet_part).values():
+        # 一个工作表的所有图片都在它关联的绘图部件里
+        if not rel_type.endswith('/drawing'):
+            continue
+        drawing_rels = read_relationships(zf, drawing_part)
+        with zf.open(drawing_part) as f:
+            # iterparse 逐个处理锚点，处理完就清空，绘图再大也不会占用太多内存
+            for _, elem in ET.iterparse(f):
+                if elem.tag not in CELL_ANCHORS:
+                    continue
+                anchor_from = elem.find(f'{{{NS_XDR}}}from')
+                if anchor_from is not None:
+                    # 锚点的行列是基于0的索引，所以需要加1来转换为Excel的基于1的行和列号
+                    row_num = int(anchor_from.findtext(f'{{{NS_XDR}}}row')) + 1
+                    col_letter = get_column_letter(int(anchor_from.findtext(f'{{{NS_XDR}}}col')) + 1)
+                    # 组合图形中可能有多张图片，全部归到锚点所在的单元格
+                    for blip in elem.iter(f'{{{NS_A}}}blip'):
+                        rel = drawing_rels.get(blip.get(f'{{{NS_REL}}}embed'))
+                        if rel:
+                            index.setdefault((row_num, col_letter), []).append(rel[1])
+                elem.clear()
+    return index
+
+# 直接从xlsx压缩包中提取图片，按单元格保存为 {列}/{行}.{原始扩展名}
+def extract_images_from_zip(file_path, sheet_name, image_cols, start_row, output_dir, verbose=True):
+    with zipfile.ZipFile(file_path) as zf:
+        index = build_image_index(zf, find_sheet_part(zf, sheet_name))
+
+        # 提前为每个图片列创建其子目录，避免在循环中重复创建
+        for col in image_cols:
+            os.makedirs(os.path.join(output_dir, col), exist_ok=True)
+
+        # 按行号顺序处理，只保留用户指定的列和起始行之后的图片
+        images = written = 0
+        for (row_num, col_letter), media_parts in sorted(index.items()):
+            if col_letter not in image_cols or row_num < start_row:
+                continue
+            for n, media_part in enumerate(media_parts):
+                # 使用图片在压缩包中的真实扩展名，例如 image3.jpeg -> 7.jpeg
+                ext = posixpath.splitext(media_part)[1].lower() or '.png'
+                # 同一单元格有多张图片时，第二张起命名为 7_1.png、7_2.png ...
+                name = f"{row_num}{ext}" if n == 0 else f"{row_num}_{n}{ext}"
+                img_path = os.path.join(output_dir, col_letter, name)
+                # 分块复制，不会把整张图片读入内存
+                with zf.open(media_part) as src, open(img_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                    written += dst.tell()
+                images += 1
+                if verbose:
+                    print(f"图片 {col_letter}{row_num} 已保存到: {img_path}") # 打印提示信息
+    # 返回图片数量和写入的字节数
+    return images, written
 
 # 定义一个函数，用于从Excel中提取文本和图片
 def extract_excel_by_column(
@@ -8,104 +172,385 @@ def extract_excel_by_column(
     text_cols,       # 包含文本的列的列表，例如 ['A', 'D']
     image_cols,      # 包含图片的列的列表，例如 ['B', 'E']
     start_row,       # 开始处理的行号
-    output_dir='output' # 输出文件夹的名称，默认为 'output'
+    output_dir='output', # 输出文件夹的名称，默认为 'output'
+    verbose=True     # 是否逐个打印保存信息（批量模式下关闭）
 ):
-    # 使用 load_workbook 加载 Excel 文件。
-    # data_only=True 表示只加载单元格的显示值，而不是公式。
-    wb = load_workbook(file_path, data_only=True)
-
-    # 检查用户输入的工作表名称是否存在
-    if sheet_name not in wb.sheetnames:
-        print("可用的工作表：", wb.sheetnames) # 提示用户所有可用的工作表名称
-        raise ValueError(f'工作表 {sheet_name} 不存在') # 抛出错误，终止程序
+    # 去掉空的列名（例如用户直接回车时得到的 ''）
+    text_cols = [col.upper() for col in text_cols if col]
+    image_cols = [col.upper() for col in image_cols if col]
 
-    # 获取指定的工作表
-    ws = wb[sheet_name]
-    
     # 创建输出目录。exist_ok=True 意味着如果目录已经存在，则不会报错。
     os.makedirs(output_dir, exist_ok=True)
 
-    # ===== 1. 每一列单独保存文本 =====
-    # 遍历所有需要提取文本的列
-    for col in text_cols:
-        # 构造文本文件的完整路径，例如 'output/D.txt'
-        txt_path = os.path.join(output_dir, f"{col}.txt")
-        
-        # 以写入模式 ('w') 打开文件，并指定编码为 'utf-8-sig'，
-        # 'utf-8-sig' 可以保证在Windows记事本中打开txt文件时不会出现乱码。
-        with open(txt_path, 'w', encoding='utf-8-sig') as f:
-            # 遍历从 start_row 到 Excel最大行 的所有行
-            for row in range(start_row, ws.max_row + 1):
-                # 获取当前单元格的值，例如 ws['D7'] 的值
-                val = ws[f"{col}{row}"].value
-                # 如果单元格有值（不是 None），则写入文件
-                if val is not None:
-                    # 将值转换成字符串并写入文件，并在末尾添加一个换行符
-                    f.write(str(val) + "\n")
-        print(f"文本列 {col} 已保存到: {txt_path}") # 打印提示信息
-
-    # ===== 2. 每一列单独保存图片 =====
-    # 注意：openpyxl 将所有图片存储在 ws._images 列表中，而不是按单元格存储。
-    
-    # 提前为每个图片列创建其子目录，避免在循环中重复创建
-    for col in image_cols:
-        img_dir = os.path.join(output_dir, col)
-        os.makedirs(img_dir, exist_ok=True)
-
-    # 遍历工作表中所有的图片对象
-    for image in ws._images:
-        # 获取图片在Excel中的锚点信息（即图片所关联的单元格位置）
-        anchor = image.anchor._from
-        
-        # openpyxl 的锚点是基于0的索引，所以需要加1来转换为Excel的基于1的行和列号
-        # 获取图片所在的列字母，例如 'E'
-        col_letter = ws.cell(row=anchor.row + 1, column=anchor.col + 1).column_letter
-        # 获取图片所在的行号，例如 7
-        row_num = anchor.row + 1
-
-        # 检查图片是否在用户指定的图片列中，并且行号大于等于起始行
-        if col_letter in image_cols and row_num >= start_row:
-            # 构造图片保存的文件夹路径，例如 'output/E'
-            img_folder = os.path.join(output_dir, col_letter)
-            # 确保图片文件夹存在 (这里因为前面已经提前创建，所以这一步也可以省略，但保留更安全)
-            os.makedirs(img_folder, exist_ok=True)
-            
-            # 构造图片的完整保存路径，例如 'output/E/7.png'
-            img_path = os.path.join(img_folder, f"{row_num}.png")
-            
-            # 以二进制写入模式 ('wb') 打开文件
-            with open(img_path, 'wb') as img_file:
-                # 将图片数据写入文件
-                img_file.write(image._data())
-            print(f"图片 {col_letter}{row_num} 已保存到: {img_path}") # 打印提示信息
-
-    print("\n提取完成！") # 所有操作完成后打印提示
+    # 统计处理的行数、图片数和写入的字节数
+    stats = {'rows': 0, 'images': 0, 'bytes': 0}
 
-# 判断当前文件是否是直接运行的（而不是被import的）
-if __name__ == '__main__':
+    # ===== 1. 每一列单独保存文本（流式单次遍历） =====
+    if text_cols:
+        stats['rows'], written = extract_text_columns(file_path, sheet_name, text_cols, start_row, output_dir, verbose)
+        stats['bytes'] += written
+
+    # ===== 2. 每一列单独保存图片（直接解析xlsx压缩包，无需加载工作簿） =====
+    if image_cols:
+        stats['images'], written = extract_images_from_zip(file_path, sheet_name, image_cols, start_row, output_dir, verbose)
+        stats['bytes'] += written
+
+    if verbose:
+        print("\n提取完成！") # 所有操作完成后打印提示
+    return stats
+
+# ===== 配对训练集导出：每行一张图片 + 同名说明文本 =====
+
+# 与 提取文本块工具.py / 批量写入文本块.py 使用同一个键
+TEXT_BLOCK_KEY = "comfy_text_block"
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 签名(8) + IHDR长度(4) + 类型(4) + 数据(13) + CRC(4)
+PNG_IHDR_END = 33
+# 多个说明列拼接时使用的分隔符
+CAPTION_SEPARATOR = ', '
+# 同时在写的行数上限（每个工作线程4个），避免20万行的任务全部堆在队列里
+MAX_PENDING_PER_JOB = 4
+
+# 生成一个PNG文本块：能用latin-1编码时写tEXt，否则写UTF-8的iTXt（与 Pillow 的 add_text 一致）
+def make_png_text_chunk(key, text):
+    try:
+        chunk_type = b'tEXt'
+        data = key.encode('latin-1') + b'\0' + text.encode('latin-1')
+    except UnicodeEncodeError:
+        # iTXt: 关键字\0 压缩标志(0) 压缩方法(0) 语言标签\0 翻译关键字\0 文本
+        chunk_type = b'iTXt'
+        data = key.encode('latin-1') + b'\0\0\0\0\0' + text.encode('utf-8')
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+# 把文本块写入图片：PNG直接在IHDR后插入文本块（像素数据原样保留），其他格式转换为PNG
+def embed_text_block(image_bytes, text):
+    if image_bytes[:8] == PNG_SIGNATURE and image_bytes[12:16] == b'IHDR':
+        return image_bytes[:PNG_IHDR_END] + make_png_text_chunk(TEXT_BLOCK_KEY, text) + image_bytes[PNG_IHDR_END:]
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # CMYK等模式不能保存为PNG
+        if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'I', 'I;16'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text(TEXT_BLOCK_KEY, text)
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG', pnginfo=pnginfo)
+        return buffer.getvalue()
+
+# 导出一行：写出图片和说明，返回清单记录和写入的字节数（在工作线程中运行）
+def export_dataset_row(zf, row_num, media_part, caption, output_dir, caption_mode):
+    image_bytes = zf.read(media_part)
+    record = {'row': row_num, 'caption': caption}
+    written = 0
+
+    if caption_mode == 'embed':
+        # 说明文本嵌入PNG，不单独写txt
+        image_bytes = embed_text_block(image_bytes, caption)
+        image_name = f"{row_num}.png"
+    else:
+        image_name = f"{row_num}{posixpath.splitext(media_part)[1].lower() or '.png'}"
+        caption_name = f"{row_num}.txt"
+        # 训练工具一般直接读取UTF-8，不写BOM
+        with open(os.path.join(output_dir, caption_name), 'w', encoding='utf-8') as f:
+            f.write(caption)
+        written += len(caption.encode('utf-8'))
+        record['caption_file'] = caption_name
+
+    with open(os.path.join(output_dir, image_name), 'wb') as f:
+        f.write(image_bytes)
+    written += len(image_bytes)
+    record['image'] = image_name
+    return record, written
+
+# 一次流式遍历导出配对训练集：每个有图片的行输出 {行号}.{扩展名} + {行号}.txt（或把说明嵌入PNG）
+def export_paired_dataset(
+    file_path,          # Excel文件的路径
+    sheet_name,         # 要操作的工作表名称
+    caption_cols,       # 说明文本所在的列，多列时用 CAPTION_SEPARATOR 拼接，例如 ['D']
+    image_col,          # 图片所在的列，例如 'E'
+    start_row,          # 开始处理的行号
+    output_dir='dataset', # 输出文件夹
+    caption_mode='txt', # 'txt' 写同名txt；'embed' 把说明写入PNG的 comfy_text_block
+    manifest=True,      # 是否同时写出 manifest.jsonl
+    jobs=None,          # 并行写入的线程数，默认等于CPU核心数
+    verbose=True        # 是否打印导出结果（批量模式下关闭）
+):
+    caption_cols = [col.upper() for col in caption_cols if col]
+    image_col = image_col.upper()
+    jobs = jobs or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    stats = {'rows': 0, 'images': 0, 'empty_captions': 0, 'bytes': 0, 'failed': 0}
+    start_time = time.perf_counter()
+
+    with zipfile.ZipFile(file_path) as zf, ExitStack() as stack:
+        # 先建立图片索引（只解析绘图XML），再流式遍历行，把说明和图片配对
+        index = build_image_index(zf, find_sheet_part(zf, sheet_name))
+        row_images = {row: parts[0] for (row, col), parts in index.items() if col == image_col and row >= start_row}
+        manifest_file = None
+        if manifest:
+            manifest_file = stack.enter_context(open(os.path.join(output_dir, 'manifest.jsonl'), 'w', encoding='utf-8'))
+
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        stack.callback(wb.close)
+        ws = wb[sheet_name]
+        ws.reset_dimensions()  # 不信任文件记录的尺寸，读到最后一行
+        col_indexes = [column_index_from_string(col) - 1 for col in caption_cols]
+        max_col = max(col_indexes, default=0) + 1
+
+        # 处理已完成的写入：写清单、累计统计、报告错误
+        def collect(futures):
+            for future in futures:
+                try:
+                    record, written = future.result()
+                except Exception as e:
+                    stats['failed'] += 1
+                    print(f"❌ 第 {pending[future]} 行导出失败: {e}")
+                    continue
+                stats['images'] += 1
+                stats['bytes'] += written
+                if manifest_file:
+                    manifest_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        pending = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            def submit(row_num, caption):
+                if not caption:
+                    stats['empty_captions'] += 1
+                future = executor.submit(export_dataset_row, zf, row_num, row_images[row_num], caption, output_dir, caption_mode)
+                pending[future] = row_num
+                # 限制同时排队的行数，完成一批处理一批
+                if len(pending) >= jobs * MAX_PENDING_PER_JOB:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                    for future in done:
+                        del pending[future]
+
+            last_row = start_row - 1
+            for row_num, row in enumerate(ws.iter_rows(min_row=start_row, max_col=max_col, values_only=True), start_row):
+                stats['rows'] += 1
+                last_row = row_num
+                if row_num not in row_images:
+                    continue
+                values = [row[i] for i in col_indexes if i < len(row) and row[i] is not None]
+                submit(row_num, CAPTION_SEPARATOR.join(str(v).strip() for v in values))
+            # 图片可能锚定在最后一个有数据的行之下，这些行没有单元格，说明为空
+            for row_num in sorted(row for row in row_images if row > last_row):
+                submit(row_num, '')
+            collect(list(pending))
+
+    elapsed = time.perf_counter() - start_time
+    if verbose:
+        print(f"导出完成：{stats['images']} 组图片+说明（空说明 {stats['empty_captions']}，失败 {stats['failed']}），"
+              f"共 {stats['bytes'] / (1024 * 1024):.1f} MB，耗时 {elapsed:.2f}s")
+    return stats
+
+# ===== 批量模式：多个工作簿 / 工作表，按工作簿多进程并行 =====
+
+# 读取工作簿中所有工作表的名称（只解析 xl/workbook.xml）
+def list_sheet_names(file_path):
+    with zipfile.ZipFile(file_path) as zf:
+        root = ET.fromstring(zf.read('xl/workbook.xml'))
+        return [sheet.get('name') for sheet in root.iter(f'{{{NS_MAIN}}}sheet')]
+
+# 把逗号分隔的列字符串（或列表）统一为列表，例如 'D, G' -> ['D', 'G']
+def parse_cols(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [col.strip().upper() for col in value or [] if col.strip()]
+
+# 读取配置文件：{"defaults": {...}, "tasks": [{"file": ..., ...}, ...]}，每个任务未写的选项取 defaults
+def load_config(config_path):
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    defaults = config.get('defaults', {})
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    tasks = []
+    for entry in config.get('tasks', []):
+        task = {**defaults, **entry}
+        # 配置中的相对路径以配置文件所在目录为准
+        task['file'] = os.path.join(base_dir, task['file'])
+        tasks.append(task)
+    return tasks
+
+# 为每个工作簿分配独立的输出目录 output_dir/工作簿名，重名时加 -2、-3 ...
+def assign_output_dirs(tasks, output_root):
+    used = set()
+    for task in tasks:
+        stem = os.path.splitext(os.path.basename(task['file']))[0]
+        name, n = stem, 2
+        while name in used:
+            name = f"{stem}-{n}"
+            n += 1
+        used.add(name)
+        task['output_dir'] = os.path.join(task.get('output_root', output_root), name)
+    return tasks
+
+# 处理一个工作簿中的全部工作表（在工作进程中运行），返回汇总
+def process_workbook(task):
+    summary = {'file': task['file'], 'output_dir': task['output_dir'], 'sheets': 0,
+               'rows': 0, 'images': 0, 'bytes': 0, 'error': None}
+    try:
+        sheets = task.get('sheets') or list_sheet_names(task['file'])
+        if isinstance(sheets, str):
+            sheets = [sheets]
+        for sheet_name in sheets:
+            # 每个工作表一个子目录：output/工作簿名/工作表名
+            sheet_dir = os.path.join(task['output_dir'], sheet_name)
+            if task.get('mode', 'columns') == 'dataset':
+                stats = export_paired_dataset(
+                    task['file'], sheet_name, parse_cols(task.get('caption_cols')), task['image_col'],
+                    int(task.get('start_row', 1)), sheet_dir, caption_mode=task.get('caption_mode', 'txt'),
+                    manifest=task.get('manifest', True), jobs=task.get('threads'), verbose=False)
+            else:
+                stats = extract_excel_by_column(
+                    task['file'], sheet_name, parse_cols(task.get('text_cols')), parse_cols(task.get('image_cols')),
+                    int(task.get('start_row', 1)), sheet_dir, verbose=False)
+            summary['sheets'] += 1
+            for key in ('rows', 'images', 'bytes'):
+                summary[key] += stats[key]
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+    return summary
+
+# 多进程处理所有工作簿并打印汇总，返回每个工作簿的结果
+def batch_extract(tasks, output_root='output', jobs=None):
+    tasks = assign_output_dirs(tasks, output_root)
+    jobs = min(jobs or os.cpu_count() or 1, len(tasks)) or 1
+    start_time = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(process_workbook, task) for task in tasks]
+        for future in as_completed(futures):
+            summary = future.result()
+            results.append(summary)
+            name = os.path.basename(summary['file'])
+            if summary['error']:
+                print(f"❌ {name}: {summary['error']}")
+            else:
+                print(f"✅ {name}: {summary['sheets']} 个工作表，{summary['rows']} 行，"
+                      f"{summary['images']} 张图片 -> {summary['output_dir']}")
+
+    elapsed = time.perf_counter() - start_time
+    ok = [r for r in results if not r['error']]
+    print("\n" + "=" * 50)
+    print(f"工作簿：成功 {len(ok)}，失败 {len(results) - len(ok)}（{jobs} 个进程，耗时 {elapsed:.2f}s）")
+    print(f"合计：{sum(r['sheets'] for r in ok)} 个工作表，{sum(r['rows'] for r in ok)} 行，"
+          f"{sum(r['images'] for r in ok)} 张图片，{sum(r['bytes'] for r in ok) / (1024 * 1024):.1f} MB")
+    return results
+
+# 解析命令行参数，不带参数运行时进入交互模式
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='从xlsx批量提取文本和图片')
+    parser.add_argument('files', nargs='*', help='xlsx文件（可以有多个）')
+    parser.add_argument('--config', help='JSON配置文件，可为每个工作簿单独指定工作表和列')
+    parser.add_argument('--sheet', action='append', dest='sheets',
+                        help='要提取的工作表，可重复指定；不指定则处理全部工作表')
+    parser.add_argument('--text', default='', help='文本列，逗号分隔，如 D,G,J')
+    parser.add_argument('--images', default='', help='图片列，逗号分隔，如 E,H,K')
+    parser.add_argument('--start', type=int, default=1, help='开始提取的行号（默认1）')
+    parser.add_argument('--dataset', metavar='图片列',
+                        help='导出配对训练集：指定图片列，--text 作为说明列')
+    parser.add_argument('--embed', action='store_true', help='训练集模式下把说明嵌入PNG文本块，而不是写txt')
+    parser.add_argument('-o', '--output', default='output', help='输出根目录（默认 output）')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='并行进程数（默认等于CPU核心数）')
+    return parser.parse_args(argv)
+
+# 把命令行参数转换为任务列表
+def tasks_from_args(args):
+    tasks = load_config(args.config) if args.config else []
+    for file_path in args.files:
+        task = {'file': file_path, 'sheets': args.sheets, 'start_row': args.start}
+        if args.dataset:
+            task.update(mode='dataset', image_col=args.dataset, caption_cols=args.text,
+                        caption_mode='embed' if args.embed else 'txt')
+        else:
+            task.update(text_cols=args.text, image_cols=args.images)
+        tasks.append(task)
+    return tasks
+
+# 交互模式：逐项询问，处理一个工作簿的一个工作表
+def interactive_main(excel_path=None):
     # ===== 用户交互部分 =====
 
-    # 提示用户拖拽 Excel 文件，并去除可能存在的引号和空格
-    excel_path = input("请将 .xlsx 文件拖入此窗口后回车：\n").strip().strip('"')
+    # 提示用户拖拽 Excel 文件，并去除可能存在的引号和空格（拖拽到脚本上打开时已自动填写）
+    if not excel_path:
+        excel_path = input("请将 .xlsx 文件拖入此窗口后回车：\n").strip().strip('"')
 
     # 用于获取工作表名称，只读模式，不加载数据，提高效率
     tmp_wb = load_workbook(excel_path, read_only=True)
     print("\n可用工作表：", tmp_wb.sheetnames)
     sheet_name = input("请输入要提取的工作表名称：").strip()
 
-    # 提示用户输入文本列，并进行处理：去除空格，按逗号分割成列表
-    text_cols = input("请输入要提取的文本列(逗号分隔，如 D,G,J)：").replace(' ', '').split(',')
-    # 提示用户输入图片列，并进行处理：去除空格，按逗号分割成列表
-    image_cols = input("请输入要提取的图片列(逗号分隔，如 E,H,K)：").replace(' ', '').split(',')
+    # 选择导出方式
+    mode = input("导出方式：1=按列分别提取（默认）  2=导出配对训练集（每行图片+同名说明）：").strip() or '1'
+
+    if mode == '2':
+        caption_cols = input("请输入说明文本所在的列(多列用逗号分隔，如 D,G)：").replace(' ', '').split(',')
+        image_col = input("请输入图片所在的列(如 E)：").strip()
+        start_row = int(input("请输入开始提取的行号(例如 7)：").strip())
+        # 说明文本写成同名txt，或者直接嵌入PNG图片的 comfy_text_block
+        embed = input("说明写入方式：1=同名txt（默认）  2=嵌入PNG文本块：").strip() == '2'
+        output_dir = input("输出目录（默认 dataset，可直接回车）：").strip() or 'dataset'
+        export_paired_dataset(excel_path, sheet_name, caption_cols, image_col, start_row, output_dir,
+                              caption_mode='embed' if embed else 'txt')
+    else:
+        # 提示用户输入文本列，并进行处理：去除空格，按逗号分割成列表
+        text_cols = input("请输入要提取的文本列(逗号分隔，如 D,G,J)：").replace(' ', '').split(',')
+        # 提示用户输入图片列，并进行处理：去除空格，按逗号分割成列表
+        image_cols = input("请输入要提取的图片列(逗号分隔，如 E,H,K)：").replace(' ', '').split(',')
 
-    # 提示用户输入起始行号，并转换为整数
-    start_row = int(input("请输入开始提取的行号(例如 7)：").strip())
+        # 提示用户输入起始行号，并转换为整数
+        start_row = int(input("请输入开始提取的行号(例如 7)：").strip())
 
-    # 提示用户输入输出目录，如果用户直接回车，则使用默认值 'output'
-    output_dir = input("输出目录（默认 output，可直接回车）：").strip() or 'output'
+        # 提示用户输入输出目录，如果用户直接回车，则使用默认值 'output'
+        output_dir = input("输出目录（默认 output，可直接回车）：").strip() or 'output'
 
-    # 调用主函数执行提取操作
-    extract_excel_by_column(excel_path, sheet_name, text_cols, image_cols, start_row, output_dir)
+        # 调用主函数执行提取操作
+        extract_excel_by_column(excel_path, sheet_name, text_cols, image_cols, start_row, output_dir)
 
     # 在所有功能执行完毕后，暂停程序，等待用户按下回车键，这样命令行窗口就不会立即关闭。
     input("\n所有操作已完成，按回车键退出...")
+
+# 拖入多个xlsx、没有指定任何列时：询问一次列设置，应用到每个工作簿的全部工作表
+def prompt_batch_columns(args):
+    print(f"共拖入 {len(args.files)} 个工作簿，以下设置将应用到每个工作簿的全部工作表")
+    args.text = input("请输入要提取的文本列(逗号分隔，如 D,G,J，没有可直接回车)：").replace(' ', '')
+    args.images = input("请输入要提取的图片列(逗号分隔，如 E,H,K，没有可直接回车)：").replace(' ', '')
+    start_row = input("请输入开始提取的行号(默认1，可直接回车)：").strip()
+    if start_row:
+        args.start = int(start_row)
+    output_dir = input(f"输出根目录（默认 {args.output}，可直接回车）：").strip()
+    if output_dir:
+        args.output = output_dir
+    return bool(args.text or args.images)
+
+def main():
+    # 不带参数（双击运行）时进入交互模式
+    if len(sys.argv) == 1:
+        interactive_main()
+        return
+
+    args = parse_args(sys.argv[1:])
+    # 把xlsx拖到脚本上、没有指定任何列时，仍然使用交互模式
+    prompted = False
+    if args.files and not (args.config or args.text or args.images or args.dataset):
+        if len(args.files) == 1:
+            interactive_main(args.files[0])
+            return
+        if not prompt_batch_columns(args):
+            input("没有指定文本列或图片列，按回车键退出...")
+            sys.exit(2)
+        prompted = True
+
+    tasks = tasks_from_args(args)
+    if not tasks:
+        print("没有要处理的工作簿，请指定xlsx文件或 --config 配置文件")
+        sys.exit(1)
+    results = batch_extract(tasks, args.output, args.jobs)
+    if prompted:
+        input("\n所有操作已完成，按回车键退出...")
+    # 有工作簿失败时返回非零状态码，方便脚本调用
+    sys.exit(1 if any(r['error'] for r in results) else 0)
+
+# 判断当前文件是否是直接运行的（而不是被import的）
+if __name__ == '__main__':
+    main()
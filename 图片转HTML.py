@@ -2,125 +2,406 @@ import sys
 import os
 import base64
 import re
+import glob
+import html
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import tkinter as tk
 from tkinter import filedialog
 
 # 配置参数
-SUPPORTED_IMAGE_EXTS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']
+SUPPORTED_IMAGE_EXTS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'svg', 'avif']
 EXT_TO_MIME = {
     'png': 'image/png',
     'jpg': 'image/jpeg',
     'jpeg': 'image/jpeg',
     'gif': 'image/gif',
     'bmp': 'image/bmp',
-    'webp': 'image/webp'
+    'webp': 'image/webp',
+    'svg': 'image/svg+xml',
+    'avif': 'image/avif'
 }
 MIME_TO_EXT = {v: k for k, v in EXT_TO_MIME.items()}
 
-def convert_image_to_html(img_path):
-    """图片转HTML（无提示）"""
-    try:
-        file_ext = os.path.splitext(img_path)[1][1:].lower()
-        if file_ext not in SUPPORTED_IMAGE_EXTS:
-            return False
+# 流式处理的块大小：编码按3字节对齐、解码按4字节对齐，内存占用与文件大小无关
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
+DECODE_CHUNK_SIZE = 4 * 256 * 1024
+HTML_READ_CHUNK = 1024 * 1024
+# 查找data URI开头时保留的重叠字节数，防止开头正好被块边界切断
+HEAD_OVERLAP = 256
 
-        with open(img_path, 'rb') as f:
-            img_data = f.read()
-        b64_data = base64.b64encode(img_data).decode('utf-8')
-        
-        html = f'''<!DOCTYPE html>
+HTML_HEAD = '''<!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8">
 </head>
 <body>
-    <img src="data:{EXT_TO_MIME[file_ext]};base64,{b64_data}">
+    <img src="data:{mime};base64,'''
+HTML_TAIL = '''">
 </body>
 </html>'''
 
-        output_path = os.path.splitext(img_path)[0] + '.html'
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html)
+# 画廊：图片数据放在data-src里，滚动到附近时才交给浏览器解码
+GALLERY_HEAD = '''<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>{title}</title>
+    <style>
+        body {{ margin: 16px; font-family: sans-serif; background: #222; color: #ddd; }}
+        main {{ display: grid; grid-template-columns: repeat(auto-fill, minmax(240px, 1fr)); gap: 12px; }}
+        figure {{ margin: 0; content-visibility: auto; contain-intrinsic-size: 240px 280px; }}
+        img {{ width: 100%; min-height: 120px; object-fit: contain; background: #333; }}
+        figcaption {{ font-size: 12px; word-break: break-all; }}
+    </style>
+</head>
+<body>
+<main>
+'''
+GALLERY_TAIL = '''</main>
+<script>
+    const images = document.querySelectorAll('img[data-src]');
+    const load = img => {
+        img.src = img.dataset.src;
+        img.removeAttribute('data-src');
+    };
+    if ('IntersectionObserver' in window) {
+        const observer = new IntersectionObserver(entries => {
+            for (const entry of entries) {
+                if (entry.isIntersecting) {
+                    load(entry.target);
+                    observer.unobserve(entry.target);
+                }
+            }
+        }, { rootMargin: '400px' });
+        images.forEach(img => observer.observe(img));
+    } else {
+        images.forEach(load);
+    }
+</script>
+</body>
+</html>
+'''
+
+DATA_URI_HEAD = re.compile(rb'data:(image/[\w.+-]+);base64,', re.IGNORECASE)
+# 负载结束符：引号、括号、逗号、尖括号；空白只有后面跟着srcset描述符（1x、2x、480w等）时才算结束，
+# 其余空白（缩进、按行折断的base64）与baseline一样在解码时删除
+PAYLOAD_END = re.compile(rb'["\'),<>]|\s+(?=\d+(?:\.\d+)?[wx][\s,"\'])')
+# 块末尾的空白及其后不完整的描述符，要和下一块拼起来才能判断是不是结束
+UNDECIDED_TAIL = re.compile(rb'\s[\s\d.wx]*\Z')
+# base64字母表之外的字节（换行、空格等）在解码前全部删除
+BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
+NON_BASE64 = bytes(c for c in range(256) if c not in BASE64_ALPHABET)
+
+def encode_base64_stream(src, dst, chunk_size=ENCODE_CHUNK_SIZE):
+    """把src文件分块编码为base64写入dst（块大小为3的倍数，拼接结果与整体编码一致）"""
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        dst.write(base64.b64encode(chunk))
+
+def decode_base64_chunk(pending, data):
+    """解码pending+data中4字节对齐的部分，返回(解码结果, 剩余未对齐部分)"""
+    pending += data.translate(None, NON_BASE64)
+    usable = len(pending) - len(pending) % 4
+    return base64.b64decode(pending[:usable]), pending[usable:]
+
+def sync_mtime(source_path, output_path):
+    """让输出文件的修改时间与源文件一致，批量转换据此判断两者是否同步"""
+    stat = os.stat(source_path)
+    os.utime(output_path, (stat.st_atime, stat.st_mtime))
+
+def image_to_html(img_path):
+    """图片转HTML，出错时抛出异常；返回输出路径"""
+    file_ext = os.path.splitext(img_path)[1][1:].lower()
+    output_path = os.path.splitext(img_path)[0] + '.html'
+    with open(img_path, 'rb') as src, open(output_path, 'wb') as dst:
+        dst.write(HTML_HEAD.format(mime=EXT_TO_MIME[file_ext]).encode('utf-8'))
+        encode_base64_stream(src, dst)
+        dst.write(HTML_TAIL.encode('utf-8'))
+    sync_mtime(img_path, output_path)
+    return output_path
+
+def convert_image_to_html(img_path):
+    """图片转HTML（无提示）"""
+    try:
+        file_ext = os.path.splitext(img_path)[1][1:].lower()
+        if file_ext not in SUPPORTED_IMAGE_EXTS:
+            return False
+        image_to_html(img_path)
         return True
     except:
         return False
 
-def convert_html_to_image(html_path):
-    """HTML转图片（无提示）"""
-    try:
-        with open(html_path, 'r', encoding='utf-8') as f:
-            content = f.read().replace('\n', ' ')
-
-        pattern = re.compile(
-            r'src\s*=\s*["\']data:(image/\w+);base64,([^"\']+)["\']', 
-            re.IGNORECASE
-        )
-        match = pattern.search(content)
-        if not match:
-            return False
+def search_payload_end(data):
+    """查找负载结束位置，返回(结束位置, None)；
+    没找到时返回(None, 切分点)，切分点之后的空白尾巴要留到读入下一块后再判断"""
+    end = PAYLOAD_END.search(data)
+    if end:
+        return end.start(), None
+    tail = UNDECIDED_TAIL.search(data)
+    return None, tail.start() if tail else len(data)
 
-        mime_type, b64_data = match.groups()
-        mime_type = mime_type.lower()
-        if mime_type not in MIME_TO_EXT:
-            return False
+def write_extracted_image(path, first_data, f):
+    """从data URI负载开头开始分块解码并写入path，遇到负载结束符为止；返回结束符之后剩余的数据
+
+    负载解码为空（被截断或格式不对）时抛出ValueError，不把空文件当作成功。
+    """
+    pending = b''
+    data = first_data
+    size = 0
+    with open(path, 'wb') as out:
+        while True:
+            end, split = search_payload_end(data)
+            decoded, pending = decode_base64_chunk(pending, data[:split if end is None else end])
+            out.write(decoded)
+            size += len(decoded)
+            if end is not None:
+                if pending:
+                    decoded = base64.b64decode(pending + b'=' * (-len(pending) % 4))
+                    out.write(decoded)
+                    size += len(decoded)
+                if not size:
+                    raise ValueError("data URI负载为空")
+                return data[end:]
+            chunk = f.read(DECODE_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("data URI没有结束")
+            data = data[split:] + chunk
+
+def extract_data_uri_images(f, make_output_path):
+    """流式提取HTML中所有base64图片（src、srcset、CSS url()等位置都会匹配）
 
-        img_data = base64.b64decode(b64_data)
-        base_name = os.path.splitext(html_path)[0]
+    make_output_path(mime) 返回输出路径，返回None表示跳过该图片。
+    返回成功写出的路径列表；中途出错时删除写了一半的文件后继续抛出异常。
+    """
+    written = []
+    buffer = b''
+    while True:
+        chunk = f.read(HTML_READ_CHUNK)
+        buffer += chunk
+        while True:
+            match = DATA_URI_HEAD.search(buffer)
+            if not match:
+                break
+            mime_type = match.group(1).decode('ascii').lower()
+            output_path = make_output_path(mime_type)
+            if output_path is None:
+                # 不支持的类型：直接跳到负载结束处
+                buffer = buffer[match.end():]
+                end, split = search_payload_end(buffer)
+                while end is None:
+                    chunk = f.read(DECODE_CHUNK_SIZE)
+                    if not chunk:
+                        return written
+                    buffer = buffer[split:] + chunk
+                    end, split = search_payload_end(buffer)
+                buffer = buffer[end:]
+                continue
+            try:
+                buffer = write_extracted_image(output_path, buffer[match.end():], f)
+            except Exception:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise
+            written.append(output_path)
+        if not chunk:
+            return written
+        buffer = buffer[-HEAD_OVERLAP:]
+
+def html_to_images(html_path):
+    """HTML转图片，提取其中所有内嵌图片，依次命名为 name.ext、name(1).ext ...；出错时抛出异常，返回输出路径列表"""
+    base_name = os.path.splitext(html_path)[0]
+
+    def make_output_path(mime_type):
+        if mime_type not in MIME_TO_EXT:
+            return None
         ext = MIME_TO_EXT[mime_type]
         output_path = f"{base_name}.{ext}"
-        
+
         # 自动处理重名文件
         counter = 1
         while os.path.exists(output_path):
             output_path = f"{base_name}({counter}).{ext}"
             counter += 1
+        return output_path
 
-        with open(output_path, 'wb') as f:
-            f.write(img_data)
-        return True
+    with open(html_path, 'rb') as f:
+        outputs = extract_data_uri_images(f, make_output_path)
+    for output_path in outputs:
+        sync_mtime(html_path, output_path)
+    return outputs
+
+def convert_html_to_image(html_path):
+    """HTML转图片（无提示）"""
+    try:
+        return len(html_to_images(html_path)) > 0
     except:
         return False
 
-def batch_convert(folder_path):
-    """静默批量转换"""
-    has_converted = False
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if os.path.isfile(file_path):
-            ext = filename.split('.')[-1].lower() if '.' in filename else ''
-            success = False
-            
-            if ext in SUPPORTED_IMAGE_EXTS:
-                success = convert_image_to_html(file_path)
-            elif ext == 'html':
-                success = convert_html_to_image(file_path)
-            
-            if success:
-                has_converted = True
-    return has_converted
+def bundle_folder_to_html(folder_path, output_path=None):
+    """把文件夹内的图片打包为一个懒加载的HTML画廊，逐张流式写入，不会同时把所有图片读入内存"""
+    folder_path = os.path.normpath(folder_path)
+    if output_path is None:
+        output_path = folder_path + '.html'
+    image_files = sorted(
+        name for name in os.listdir(folder_path)
+        if os.path.isfile(os.path.join(folder_path, name))
+        and os.path.splitext(name)[1][1:].lower() in SUPPORTED_IMAGE_EXTS
+    )
+    if not image_files:
+        return 0
+
+    title = html.escape(os.path.basename(folder_path))
+    with open(output_path, 'wb') as dst:
+        dst.write(GALLERY_HEAD.format(title=title).encode('utf-8'))
+        for name in image_files:
+            mime = EXT_TO_MIME[os.path.splitext(name)[1][1:].lower()]
+            caption = html.escape(name)
+            dst.write(f'<figure><img alt="{caption}" data-src="data:{mime};base64,'.encode('utf-8'))
+            with open(os.path.join(folder_path, name), 'rb') as src:
+                encode_base64_stream(src, dst)
+            dst.write(f'"><figcaption>{caption}</figcaption></figure>\n'.encode('utf-8'))
+        dst.write(GALLERY_TAIL.encode('utf-8'))
+    return len(image_files)
+
+def get_file_kind(file_path):
+    """返回 'image'、'html' 或 None"""
+    ext = os.path.splitext(file_path)[1][1:].lower()
+    if ext in SUPPORTED_IMAGE_EXTS:
+        return 'image'
+    if ext == 'html':
+        return 'html'
+    return None
+
+def is_up_to_date(file_path):
+    """判断转换结果是否已是最新
+
+    转换输出会继承源文件的修改时间（见sync_mtime），所以：
+    图片：同名HTML存在且修改时间不早于图片；name(n).ext 也可以是从 name.html 提取出的副本。
+    HTML：存在修改时间不早于HTML的同名图片（name.ext 或 name(n).ext），
+    即这个HTML的来源图片或从当前版本提取出的结果；HTML改动后会重新提取。
+    """
+    base_name = os.path.splitext(file_path)[0]
+    source_mtime = os.path.getmtime(file_path)
+    if get_file_kind(file_path) == 'image':
+        html_paths = [base_name + '.html']
+        copy_of = re.fullmatch(r'(.*)\(\d+\)', base_name, re.DOTALL)
+        if copy_of:
+            html_paths.append(copy_of.group(1) + '.html')
+        return any(os.path.exists(path) and os.path.getmtime(path) >= source_mtime for path in html_paths)
+    pattern = glob.escape(base_name)
+    for ext in SUPPORTED_IMAGE_EXTS:
+        candidates = [f"{base_name}.{ext}"] + glob.glob(f"{pattern}([0-9]*).{ext}")
+        if any(os.path.exists(path) and os.path.getmtime(path) >= source_mtime for path in candidates):
+            return True
+    return False
+
+def collect_convertible_files(folder_path):
+    """递归收集文件夹内可转换的文件"""
+    files = []
+    for dirpath, _, filenames in os.walk(folder_path):
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            if get_file_kind(file_path):
+                files.append(file_path)
+    return files
+
+def convert_file(file_path):
+    """转换单个文件（批量转换的工作进程），返回结果字典
+
+    status为 'ok'、'skipped'（已是最新）、'empty'（HTML中没有内嵌图片）或 'failed'。
+    """
+    result = {'path': file_path, 'status': 'ok', 'error': None, 'bytes': 0, 'outputs': []}
+    try:
+        if is_up_to_date(file_path):
+            result['status'] = 'skipped'
+            return result
+        result['bytes'] = os.path.getsize(file_path)
+        if get_file_kind(file_path) == 'image':
+            result['outputs'] = [image_to_html(file_path)]
+        else:
+            result['outputs'] = html_to_images(file_path)
+            if not result['outputs']:
+                result['status'] = 'empty'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+def batch_convert(folder_path, jobs=None):
+    """静默批量转换（递归子文件夹，多进程并行），返回每个文件的结果列表"""
+    files = collect_convertible_files(folder_path)
+    if not files:
+        return []
+
+    jobs = jobs or os.cpu_count() or 1
+    results = []
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(convert_file, file_path) for file_path in files]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['status'] == 'failed':
+                print(f"❌ {os.path.relpath(result['path'], folder_path)}: {result['error']}")
+    print_batch_summary(results, time.perf_counter() - start_time, jobs)
+    return results
+
+def print_batch_summary(results, elapsed, jobs):
+    """打印批量转换的统计和吞吐量"""
+    converted = [r for r in results if r['status'] == 'ok']
+    skipped = sum(1 for r in results if r['status'] == 'skipped')
+    empty = sum(1 for r in results if r['status'] == 'empty')
+    failed = sum(1 for r in results if r['status'] == 'failed')
+    total_mb = sum(r['bytes'] for r in converted) / (1024 * 1024)
+    elapsed = max(elapsed, 1e-6)
+    print(f"共 {len(results)} 个文件：转换 {len(converted)}，跳过（已是最新） {skipped}，"
+          f"无内嵌图片 {empty}，失败 {failed}")
+    print(f"耗时 {elapsed:.2f}s（{jobs} 个进程），{len(converted) / elapsed:.1f} 个/秒，{total_mb / elapsed:.1f} MB/秒")
+
+def parse_args(argv):
+    """解析命令行参数（拖放文件时参数就是文件路径）"""
+    parser = argparse.ArgumentParser(description='图片与HTML互转')
+    parser.add_argument('paths', nargs='*', help='图片、HTML文件或文件夹')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='批量转换的并行进程数（默认等于CPU核心数）')
+    parser.add_argument('-b', '--batch', action='store_true',
+                        help='对文件夹执行递归批量转换，而不是打包为HTML画廊')
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args(sys.argv[1:])
+
     # 批量模式（双击运行）
-    if len(sys.argv) == 1:
+    if not args.paths:
         root = tk.Tk()
         root.withdraw()
         folder_path = filedialog.askdirectory(title="选择要转换的文件夹")
         if folder_path:
-            if batch_convert(folder_path):
-                print("转换成功")
-            else:
+            if not batch_convert(folder_path, args.jobs):
                 print("未找到可转换文件")
         sys.exit()
     
-    # 单文件模式（拖放文件）
-    for file_path in sys.argv[1:]:
-        if os.path.isfile(file_path):
-            base_name = os.path.basename(file_path)
-            ext = base_name.split('.')[-1].lower() if '.' in base_name else ''
-            
-            if ext in SUPPORTED_IMAGE_EXTS:
+    # 单文件模式（拖放文件），拖放文件夹则打包为一个HTML画廊
+    for file_path in args.paths:
+        if os.path.isdir(file_path):
+            if args.batch:
+                if not batch_convert(file_path, args.jobs):
+                    print(f"未找到可转换文件: {file_path}")
+                continue
+            count = bundle_folder_to_html(file_path)
+            if count:
+                print(f"已打包 {count} 张图片: {os.path.normpath(file_path)}.html")
+            else:
+                print(f"文件夹中没有图片: {file_path}")
+        elif os.path.isfile(file_path):
+            kind = get_file_kind(file_path)
+            if kind == 'image':
                 convert_image_to_html(file_path)
-            elif ext == 'html':
+            elif kind == 'html':
                 convert_html_to_image(file_path)
 
 if __name__ == '__main__':
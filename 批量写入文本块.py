@@ -1,9 +1,16 @@
 import sys
 import os
+import json
+import time
+import zlib
+import struct
+import shutil
+import tempfile
 from PIL import Image, PngImagePlugin # 导入 PngImagePlugin 用于存储PNG元数据
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import re # 导入 re 模块用于自然排序
+from concurrent.futures import ThreadPoolExecutor
 
 # -------------------- 配置 --------------------
 # ZML节点用于存储文本块的特定键名
@@ -15,6 +22,29 @@ TARGET_EXTENSION = '.png'
 # 所有支持读取并可能转换的图片文件扩展名
 # 用户提供的脚本本身支持这些，所以我们在转换前也应该支持读取
 READABLE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp']
+
+# PNG文件头和文本类数据块类型
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_CHUNK_TYPES = (b'tEXt', b'zTXt', b'iTXt')
+
+# 复制IDAT等数据块时每次读写的字节数
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# 文本超过此字节数（UTF-8）时写为zlib压缩的iTXt，长提示词可明显缩小文件
+TEXT_COMPRESS_THRESHOLD = 1024
+
+# 转换为PNG时按原始数据保留的非文本元数据（分别对应iCCP、pHYs、eXIf块）
+BINARY_METADATA_KEYS = ('icc_profile', 'dpi', 'exif')
+
+# 批量写入的线程数（None 表示由 ThreadPoolExecutor 按CPU核心数自动决定）
+WRITE_JOBS = None
+
+# 进度条最短刷新间隔（秒）和宽度
+PROGRESS_REFRESH_SECONDS = 0.2
+PROGRESS_BAR_WIDTH = 30
+
+# 写入结果日志（JSONL，每张图片一行），保存在图像文件夹中；文件夹不可写时保存在脚本旁边
+RESULT_LOG_NAME = "文本块写入结果.jsonl"
 # ----------------------------------------------
 
 
@@ -53,44 +83,196 @@ def read_text_from_file(txt_filepath):
         messagebox.showerror("错误", f"读取TXT文件时发生错误: {e}")
         return None
 
-def write_text_to_image_metadata(image_filepath, text_content):
+def make_png_text_chunk(key, text):
+    """
+    构造一个完整的PNG文本块（长度+类型+数据+CRC）。
+    长文本写为压缩的UTF-8 iTXt；短文本能用latin-1编码时写tEXt，否则写未压缩的iTXt。
+    """
+    text_bytes = text.encode('utf-8')
+    if len(text_bytes) > TEXT_COMPRESS_THRESHOLD:
+        # iTXt: 关键字\0 压缩标志(1) 压缩方法(0=zlib) 语言标签\0 翻译关键字\0 压缩后的文本
+        chunk_type = b'iTXt'
+        data = key.encode('latin-1') + b'\0\1\0\0\0' + zlib.compress(text_bytes, 9)
+    else:
+        try:
+            chunk_type = b'tEXt'
+            data = key.encode('latin-1') + b'\0' + text.encode('latin-1')
+        except UnicodeEncodeError:
+            # iTXt: 关键字\0 压缩标志(0) 压缩方法(0) 语言标签\0 翻译关键字\0 文本
+            chunk_type = b'iTXt'
+            data = key.encode('latin-1') + b'\0\0\0\0\0' + text_bytes
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+def copy_bytes(src, dst, length):
+    """
+    从src向dst顺序复制length字节，分段读写，不把整个数据块读入内存。
     """
-    将文本内容写入到PNG图像的comfy_text_block元数据中。
+    while length > 0:
+        buffer = src.read(min(length, COPY_BUFFER_SIZE))
+        if not buffer:
+            raise ValueError("PNG文件被截断")
+        dst.write(buffer)
+        length -= len(buffer)
+
+def rewrite_png_text_block(image_filepath, text_content):
     """
-    base_name = os.path.basename(image_filepath)
+    在数据块层面重写PNG的comfy_text_block，不解码也不重新压缩图像。
+    IDAT以及iCCP、pHYs、gAMA、eXIf等数据块按字节原样复制，旧的同名文本块被删除，新文本块插入在IHDR之后。
+    先写到同目录的临时文件，完成后再替换原图，中途出错不会损坏原图。
+    """
+    key_bytes = TEXT_BLOCK_KEY.encode('latin-1')
+    new_chunk = make_png_text_chunk(TEXT_BLOCK_KEY, text_content)
+    folder_path = os.path.dirname(os.path.abspath(image_filepath))
+
+    with open(image_filepath, 'rb') as src:
+        if src.read(8) != PNG_SIGNATURE:
+            raise ValueError("文件不是PNG格式，无法写入文本块")
+
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=folder_path)
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                dst.write(PNG_SIGNATURE)
+                inserted = False
+                while True:
+                    header = src.read(8)
+                    if len(header) < 8:
+                        raise ValueError("PNG文件被截断（缺少IEND块）")
+                    length, chunk_type = struct.unpack('>I4s', header)
+
+                    if chunk_type in TEXT_CHUNK_TYPES:
+                        # 文本块较小，整块读入以比较关键字；旧的comfy_text_block直接丢弃
+                        body = src.read(length + 4)
+                        if len(body) < length + 4:
+                            raise ValueError("PNG文件被截断")
+                        if body.split(b'\0', 1)[0] == key_bytes:
+                            continue
+                        dst.write(header + body)
+                    else:
+                        # 其他数据块（含CRC）原样复制
+                        dst.write(header)
+                        copy_bytes(src, dst, length + 4)
+
+                    if chunk_type == b'IHDR':
+                        dst.write(new_chunk)
+                        inserted = True
+                    elif chunk_type == b'IEND':
+                        break
+
+                if not inserted:
+                    raise ValueError("PNG文件缺少IHDR块")
+
+            # mkstemp创建的文件权限是0600，沿用原图的权限
+            shutil.copymode(image_filepath, temp_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    os.replace(temp_path, image_filepath)
+
+def write_one_text_block(image_filepath, text_content):
+    """
+    写入单张图片的文本块（在工作线程中运行），不打印，返回一条结果记录。
+    """
+    record = {'file': os.path.basename(image_filepath), 'status': 'ok', 'text_length': len(text_content)}
     try:
-        with Image.open(image_filepath) as img:
-            # 再次确认是PNG格式（经过转换后应该是）
-            if img.format != "PNG":
-                print(f"❌ 内部错误: 图片 '{base_name}' 格式不是PNG，无法写入文本块。")
-                return False
+        rewrite_png_text_block(image_filepath, text_content)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = str(e) or type(e).__name__
+    return record
 
-            pnginfo = PngImagePlugin.PngInfo()
-            
-            # 遍历原始图像的info字典，保留其他元数据
-            for k, v in img.info.items():
-                if k != TEXT_BLOCK_KEY: 
-                    pnginfo.add_text(k, v)
-            
-            # 添加或更新comfy_text_block
-            pnginfo.add_text(TEXT_BLOCK_KEY, text_content)
-            
-            img.save(image_filepath, pnginfo=pnginfo)
-            print(f"✅ 成功写入: '{base_name}' 的文本块。")
-            return True
+def print_progress(done, total, failed, start_time):
+    """
+    在同一行刷新进度条。
+    """
+    filled = PROGRESS_BAR_WIDTH * done // max(total, 1)
+    bar = '█' * filled + '░' * (PROGRESS_BAR_WIDTH - filled)
+    speed = done / max(time.perf_counter() - start_time, 1e-6)
+    print(f"\r[{bar}] {done}/{total}  失败 {failed}  {speed:.0f} 张/秒", end='', flush=True)
 
-    except FileNotFoundError:
-        print(f"❌ 错误: 未找到图片文件 '{base_name}'。")
-        return False
-    except Exception as e:
-        print(f"❌ 错误: 写入图片 '{base_name}' 的文本块时发生错误: {e}")
-        return False
+def open_result_log(log_path):
+    """
+    打开结果日志，返回 (文件对象, 实际路径)。
+    指定位置无法写入（如图像文件夹只读）时改为写到脚本旁边，仍失败时返回 (None, None)，不影响写入图片。
+    """
+    fallback_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), RESULT_LOG_NAME)
+    for path in dict.fromkeys([log_path, fallback_path]):
+        try:
+            return open(path, 'w', encoding='utf-8'), path
+        except OSError as e:
+            print(f"❗ 无法写入结果日志 '{path}': {e}")
+    return None, None
+
+def batch_write_text_blocks(image_folder_path, image_filenames, text_lines, jobs=None, log_path=None):
+    """
+    用线程池并行写入文本块，每张图片各自通过临时文件+替换原子提交。
+    控制台只显示节流刷新的进度条，每张图片的结果写入JSONL日志。
+    返回 (成功数, 失败数, 日志路径)；日志无法写出时日志路径为None。
+    """
+    if log_path is None:
+        log_path = os.path.join(image_folder_path, RESULT_LOG_NAME)
+    total = len(image_filenames)
+    success_count = 0
+    failure_count = 0
+    start_time = time.perf_counter()
+    last_refresh = 0.0
+
+    log_file, log_path = open_result_log(log_path)
+
+    # 写入主要是文件读写和zlib/CRC计算（均会释放GIL），线程池即可并行
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            image_filepaths = [os.path.join(image_folder_path, name) for name in image_filenames]
+            # map 按提交顺序返回结果，日志顺序与图片顺序一致
+            results = executor.map(write_one_text_block, image_filepaths, text_lines)
+            for done, record in enumerate(results, 1):
+                if record['status'] == 'ok':
+                    success_count += 1
+                else:
+                    failure_count += 1
+                if log_file:
+                    log_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+                now = time.perf_counter()
+                if now - last_refresh >= PROGRESS_REFRESH_SECONDS or done == total:
+                    print_progress(done, total, failure_count, start_time)
+                    last_refresh = now
+    finally:
+        if log_file:
+            log_file.close()
+
+    print()
+    elapsed = time.perf_counter() - start_time
+    print(f"耗时 {elapsed:.2f}s，{total / max(elapsed, 1e-6):.0f} 张/秒")
+    return success_count, failure_count, log_path
+
+def collect_png_save_params(img):
+    """
+    收集转换为PNG时要保留的元数据，返回可直接传给 img.save 的参数。
+    ICC色彩配置、DPI和EXIF按原始数据写入对应的PNG数据块，只有字符串值才作为文本块写入。
+    """
+    params = {}
+    for key in BINARY_METADATA_KEYS:
+        if img.info.get(key):
+            params[key] = img.info[key]
+
+    # 需要转换色彩模式时（如CMYK、灰度转RGBA），原ICC配置与新模式不匹配，不能保留
+    # 显式传None，否则Pillow保存时会从img.info里取回原配置
+    if img.mode not in ("RGB", "RGBA"):
+        params['icc_profile'] = None
+
+    pnginfo = PngImagePlugin.PngInfo()
+    for k, v in img.info.items():
+        if k not in BINARY_METADATA_KEYS and isinstance(k, str) and isinstance(v, str):
+            pnginfo.add_text(k, v)
+    if pnginfo.chunks:
+        params['pnginfo'] = pnginfo
+    return params
 
 def convert_to_png_and_delete_original(file_path):
     """
     将指定文件转换为PNG格式，然后删除原始文件。
-    会尝试保留原始PNG的特定元数据（如comfy_text_block）
-    但对于非PNG格式，通常无法保留其特有的元数据（如JPG的EXIF）。
+    会保留原图的ICC色彩配置、DPI、EXIF以及字符串类型的文本元数据。
     """
     base_name = os.path.basename(file_path)
     folder_path = os.path.dirname(file_path)
@@ -99,22 +281,15 @@ def convert_to_png_and_delete_original(file_path):
 
     try:
         with Image.open(file_path) as img:
+            # 在转换色彩模式之前收集元数据
+            save_params = collect_png_save_params(img)
+
             # 确保图像模式是RGB或RGBA，以避免转换问题（例如灰度图转彩色）
             if img.mode not in ("RGB", "RGBA"):
                 img = img.convert("RGBA") # 转换为带透明度的RGB模式
 
-            # 如果原图已经是PNG，且包含TEXT_BLOCK_KEY，尝试保留
-            # 这是为了处理用户可能先有PNG，但有其他非PNG文件的情况
-            pnginfo_to_transfer = PngImagePlugin.PngInfo()
-            if img.format == "PNG" and img.info:
-                 for k, v in img.info.items():
-                     pnginfo_to_transfer.add_text(k, v)
-
             # 保存为新的PNG文件
-            if pnginfo_to_transfer.width > 0: # If pnginfo_to_transfer has content
-                img.save(new_filepath, pnginfo=pnginfo_to_transfer)
-            else:
-                img.save(new_filepath)
+            img.save(new_filepath, **save_params)
             
             print(f"➡️ 成功转换: '{base_name}' -> '{name_without_ext}{TARGET_EXTENSION}'")
         
@@ -248,32 +423,27 @@ def main():
             messagebox.showinfo("取消", "用户取消操作，脚本退出。")
             sys.exit()
 
-    # 8. 批量写入文本块
-    success_write_count = 0
-    failure_write_count = 0
-
-    for i in range(min(len(text_lines), len(final_png_files))): 
-        text_content = text_lines[i]
-        image_filename = final_png_files[i]
-        image_filepath = os.path.join(image_folder_path, image_filename)
-        
-        print(f"\n>>>> 正在处理图片: '{image_filename}' (第 {i+1} / {len(final_png_files)} 张)")
-        print(f"     将写入文本: '{text_content}'")
-
-        if write_text_to_image_metadata(image_filepath, text_content):
-            success_write_count += 1
-        else:
-            failure_write_count += 1
+    # 8. 批量写入文本块（多线程，控制台只显示进度条）
+    count = min(len(text_lines), len(final_png_files))
+    print(f"\n开始写入 {count} 张图片的文本块...")
+    success_write_count, failure_write_count, log_path = batch_write_text_blocks(
+        image_folder_path, final_png_files[:count], text_lines[:count], WRITE_JOBS
+    )
 
     print("\n" + "="*50)
     print("所有图片处理完毕！")
     print(f"成功写入: {success_write_count} 张图片")
     print(f"写入失败: {failure_write_count} 张图片")
+    if log_path:
+        print(f"逐张结果已记录到: {log_path}")
+    else:
+        print("❗ 结果日志未能写出，请查看上方提示。")
     print("="*50)
     
     messagebox.showinfo(
         "完成", 
-        f"批量写入文本块已完成！\n成功修改: {success_write_count} 张图片\n修改失败: {failure_write_count} 张图片"
+        f"批量写入文本块已完成！\n成功修改: {success_write_count} 张图片\n修改失败: {failure_write_count} 张图片\n"
+        f"详细结果见: {log_path or '（日志未能写出）'}"
     )
     
     root.destroy() 
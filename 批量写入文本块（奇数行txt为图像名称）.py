@@ -1,9 +1,11 @@
 import sys
 import os
-from PIL import Image, PngImagePlugin # 导入 PngImagePlugin 用于存储PNG元数据
+from PIL import Image # 用于把非PNG图片转换为PNG
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import re # 导入 re 模块用于自然排序
+# 文本块的数据块级写入与元数据保留逻辑与主脚本共用
+from 批量写入文本块 import rewrite_png_text_block, collect_png_save_params
 
 # -------------------- 配置 --------------------
 # ZML节点用于存储文本块的特定键名
@@ -87,29 +89,13 @@ def read_text_from_file(txt_filepath):
 def write_text_to_image_metadata(image_filepath, text_content):
     """
     将文本内容写入到PNG图像的comfy_text_block元数据中。
+    只改写文本块，像素数据和其他元数据（ICC、DPI、EXIF、其他文本块）保持不变。
     """
     base_name = os.path.basename(image_filepath)
     try:
-        with Image.open(image_filepath) as img:
-            # 确保是PNG格式
-            if img.format != "PNG":
-                print(f"❌ 内部错误: 图片 '{base_name}' 格式不是PNG，无法写入文本块。")
-                return False
-
-            pnginfo = PngImagePlugin.PngInfo()
-            
-            # 遍历原始图像的info字典，保留其他元数据
-            for k, v in img.info.items():
-                if k != TEXT_BLOCK_KEY and isinstance(k, str) and isinstance(v, str): 
-                    pnginfo.add_text(k, v)
-            
-            # 添加或更新comfy_text_block
-            pnginfo.add_text(TEXT_BLOCK_KEY, text_content)
-            
-            # 保存到原始路径，覆盖原文件
-            img.save(image_filepath, pnginfo=pnginfo)
-            # print(f"✅ 成功写入: '{base_name}' 的文本块。") # 这一步在重命名后执行，不在控制台显示详细信息
-            return True
+        rewrite_png_text_block(image_filepath, text_content)
+        # print(f"✅ 成功写入: '{base_name}' 的文本块。") # 这一步在重命名后执行，不在控制台显示详细信息
+        return True
 
     except FileNotFoundError:
         print(f"❌ 错误: 未找到图片文件 '{base_name}'。")
@@ -131,22 +117,14 @@ def convert_to_png_and_delete_original(file_path):
 
     try:
         with Image.open(file_path) as img:
+            # 在转换色彩模式之前收集元数据（ICC、DPI、EXIF和字符串文本）
+            save_params = collect_png_save_params(img)
+
             # 确保图像模式是RGB或RGBA，以避免转换问题（例如灰度图转彩色）
             if img.mode not in ("RGB", "RGBA"):
                 img = img.convert("RGBA") # 转换为带透明度的RGB模式
 
-            # 如果原图已经是PNG，且包含TEXT_BLOCK_KEY，尝试保留
-            pnginfo_to_transfer = PngImagePlugin.PngInfo()
-            if img.format == "PNG" and img.info:
-                 for k, v in img.info.items():
-                     if isinstance(k, str) and isinstance(v, str): # 确保键值都是字符串
-                         pnginfo_to_transfer.add_text(k, v)
-
-            # 保存为新的PNG文件
-            if pnginfo_to_transfer.text:
-                img.save(new_filepath, pnginfo=pnginfo_to_transfer)
-            else:
-                img.save(new_filepath)
+            img.save(new_filepath, **save_params)
             
             print(f"➡️ 成功转换: '{base_name}' -> '{name_without_ext}{TARGET_EXTENSION}'")
         
@@ -2,10 +2,16 @@
 
 import sys
 import os
-from PIL import Image
-import pyperclip
-import tkinter as tk
-from tkinter import filedialog
+import csv
+import json
+import time
+import zlib
+import struct
+import argparse
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+# pyperclip 和 tkinter 只在拖拽/弹窗模式中按需导入，
+# 这样命令行批量提取和 文本块索引.py 在没有图形界面的服务器上也能使用本模块
 
 # -------------------- 配置 --------------------
 # ZML节点用于存储文本块的特定键名
@@ -16,14 +22,89 @@ OUTPUT_SUBFOLDER = "文本块提取"
 
 # 支持的图片文件扩展名
 SUPPORTED_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp']
+
+# 汇总输出模式下的文件格式：每张图片一个txt，或者汇总为一个 JSONL / CSV 文件
+OUTPUT_FORMATS = ['txt', 'jsonl', 'csv']
+
+# 文件夹模式下每处理多少个文件打印一次进度
+PROGRESS_INTERVAL = 1000
+
+# 文本块解压后的最大长度，防止损坏或恶意的压缩块占满内存（与Pillow的限制相同）
+MAX_TEXT_SIZE = 1024 * 1024
 # ----------------------------------------------
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_CHUNK_TYPES = (b'tEXt', b'zTXt', b'iTXt')
+
+
+def decompress_text(data):
+    """解压zTXt/iTXt中的压缩文本，超过 MAX_TEXT_SIZE 视为损坏"""
+    decompressor = zlib.decompressobj()
+    text = decompressor.decompress(data, MAX_TEXT_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ValueError("文本块过大")
+    return text
+
+
+def decode_text_chunk(chunk_type, data):
+    """解析 tEXt/zTXt/iTXt 块的数据，返回 (键, 文本)"""
+    key, _, rest = data.partition(b'\0')
+    key = key.decode('latin-1')
+    if chunk_type == b'tEXt':
+        return key, rest.decode('latin-1')
+    if chunk_type == b'zTXt':
+        # 第一个字节是压缩方法（只有0=zlib）
+        return key, decompress_text(rest[1:]).decode('latin-1')
+    # iTXt: 压缩标志(1) 压缩方法(1) 语言标签\0 翻译后的键\0 UTF-8文本
+    compressed = rest[:1] == b'\1'
+    _, _, rest = rest[2:].partition(b'\0')
+    _, _, text = rest.partition(b'\0')
+    if compressed:
+        text = decompress_text(text)
+    return key, text.decode('utf-8')
+
+
+def read_png_text_chunks(filepath, keys=None):
+    """
+    只读取PNG的签名和各个块的头部，直接跳过IDAT等图像数据，解析其中的文本块。
+    keys 不为空时只解析这些键，并在全部找到后提前结束；
+    否则解析全部文本块，同一个键出现多次时以最后一个为准（与Pillow一致）。
+    返回 {键: 文本}；不是PNG文件时返回 None。
+    """
+    texts = {}
+    with open(filepath, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break # 文件被截断，返回已读到的内容
+            length, chunk_type = struct.unpack('>I4s', header)
+            if chunk_type == b'IEND':
+                break
+            if chunk_type not in TEXT_CHUNK_TYPES:
+                # 跳过数据和4字节CRC
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+            data = f.read(length)
+            f.seek(4, os.SEEK_CUR)
+            # 先用键名过滤，不需要的块不解压
+            if keys and data.partition(b'\0')[0].decode('latin-1') not in keys:
+                continue
+            key, text = decode_text_chunk(chunk_type, data)
+            texts[key] = text
+            if keys and all(k in texts for k in keys):
+                break
+    return texts
+
 
 def handle_drag_and_drop(filepaths):
     """
     处理拖拽至脚本的单个或多个文件。
     将第一个有效图片的文本块复制到剪贴板。
     """
+    import pyperclip
+
     print("模式: [拖拽处理模式]")
     print(f"检测到 {len(filepaths)} 个文件...\n" + "="*30)
 
@@ -36,19 +117,21 @@ def handle_drag_and_drop(filepaths):
             continue
 
         try:
-            with Image.open(filepath) as img:
-                if img.info and TEXT_BLOCK_KEY in img.info:
-                    content = img.info[TEXT_BLOCK_KEY]
-                    
-                    if not found_text_and_copied:
-                        pyperclip.copy(content)
-                        print("   -> ✅ 成功！文本内容已复制到剪贴板。")
-                        found_text_and_copied = True
-                    else:
-                        print("   -> ✅ 找到文本 (剪贴板已有内容，未覆盖)。")
-                    print("") # 换行
+            texts = read_png_text_chunks(filepath, (TEXT_BLOCK_KEY,))
+            if texts is None:
+                print("   -> ℹ️ 不是PNG图片，不会包含文本块。\n")
+            elif TEXT_BLOCK_KEY in texts:
+                content = texts[TEXT_BLOCK_KEY]
+                
+                if not found_text_and_copied:
+                    pyperclip.copy(content)
+                    print("   -> ✅ 成功！文本内容已复制到剪贴板。")
+                    found_text_and_copied = True
                 else:
-                    print("   -> ℹ️ 未在此图中找到可提取的文本块。\n")
+                    print("   -> ✅ 找到文本 (剪贴板已有内容，未覆盖)。")
+                print("") # 换行
+            else:
+                print("   -> ℹ️ 未在此图中找到可提取的文本块。\n")
         except Exception as e:
             print(f"   -> ❌ 处理图片时出错: {e}\n")
 
@@ -64,6 +147,8 @@ def handle_folder_selection():
     处理双击脚本时弹出的文件夹选择。
     提取文件夹内所有图片的文本块并保存为txt文件。
     """
+    from tkinter import filedialog
+
     print("模式: [文件夹处理模式]")
     
     # 弹出文件夹选择对话框
@@ -77,19 +162,33 @@ def handle_folder_selection():
 
     print(f"已选择文件夹: {folder_path}")
     
+    # 是否包含子文件夹
+    try:
+        recursive = input("是否包含子文件夹? (输入 y 表示包含，直接回车只处理当前文件夹): ").lower() == 'y'
+    except (EOFError, KeyboardInterrupt):
+        print("\n操作已取消。")
+        return
+
     # 扫描文件夹内的图片
-    image_files = [f for f in os.listdir(folder_path) 
-                   if os.path.splitext(f)[1].lower() in SUPPORTED_EXTENSIONS]
+    image_files = collect_image_files(folder_path, recursive)
 
     if not image_files:
         print("此文件夹中未找到支持的图片文件。")
         return
         
     print(f"找到 {len(image_files)} 个图片文件。")
+
+    # 选择输出方式：大量图片时汇总为一个文件，避免创建成千上万个小txt
+    try:
+        choice = input("输出方式：1=每张图片一个txt（默认）  2=汇总为一个JSONL  3=汇总为一个CSV: ").strip()
+    except (EOFError, KeyboardInterrupt):
+        print("\n操作已取消。")
+        return
+    output_format = {'2': 'jsonl', '3': 'csv'}.get(choice, 'txt')
     
     # 请求用户二次确认
     try:
-        confirm = input("即将开始提取文本块并保存为txt文件，是否继续? (输入 y 表示同意): ").lower()
+        confirm = input("即将开始提取文本块，是否继续? (输入 y 表示同意): ").lower()
     except (EOFError, KeyboardInterrupt):
         print("\n操作已取消。")
         return
@@ -98,56 +197,140 @@ def handle_folder_selection():
         print("操作已取消。")
         return
 
-    # 创建输出子文件夹
-    output_dir = os.path.join(folder_path, OUTPUT_SUBFOLDER)
-    os.makedirs(output_dir, exist_ok=True)
-    print(f"提取的文本将保存在: {output_dir}\n" + "="*30)
-    
+    extract_folder(folder_path, image_files, output_format)
+
+
+def collect_image_files(folder_path, recursive=True):
+    """收集文件夹内的图片路径（按扩展名初筛，是否为PNG在读取时按文件头判断），跳过输出子文件夹"""
+    if not recursive:
+        return [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path))
+                if os.path.splitext(f)[1].lower() in SUPPORTED_EXTENSIONS]
+    image_files = []
+    for dirpath, dirnames, filenames in os.walk(folder_path):
+        dirnames[:] = sorted(d for d in dirnames if d != OUTPUT_SUBFOLDER)
+        image_files.extend(os.path.join(dirpath, f) for f in sorted(filenames)
+                           if os.path.splitext(f)[1].lower() in SUPPORTED_EXTENSIONS)
+    return image_files
+
+
+def extract_one(filepath, folder_path, txt_output_dir=None):
+    """
+    读取一张图片的文本块（在工作线程中运行）。
+    txt_output_dir 不为空时直接写出同名txt，子文件夹结构保持不变。
+    返回 (相对路径, 文本块或None, 错误信息或None)。
+    """
+    relative_path = os.path.relpath(filepath, folder_path)
+    try:
+        texts = read_png_text_chunks(filepath, (TEXT_BLOCK_KEY,))
+        content = texts.get(TEXT_BLOCK_KEY) if texts else None
+        if content is not None and txt_output_dir:
+            txt_filepath = os.path.join(txt_output_dir, os.path.splitext(relative_path)[0] + ".txt")
+            os.makedirs(os.path.dirname(txt_filepath), exist_ok=True)
+            with open(txt_filepath, 'w', encoding='utf-8') as f:
+                f.write(content)
+        return relative_path, content, None
+    except Exception as e:
+        return relative_path, None, str(e)
+
+
+def extract_folder(folder_path, image_files, output_format='txt', output_path=None, jobs=None):
+    """
+    多线程提取图片的文本块。
+    txt：每张图片在 OUTPUT_SUBFOLDER 中生成一个同名txt；
+    jsonl/csv：按图片顺序汇总为一个文件，每条记录为 (相对路径, 文本块)。
+    """
+    # 读取块头主要是等待磁盘/网络，线程数可以比CPU核心数多
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+    txt_output_dir = None
+    if output_format == 'txt':
+        txt_output_dir = output_path or os.path.join(folder_path, OUTPUT_SUBFOLDER)
+        os.makedirs(txt_output_dir, exist_ok=True)
+        print(f"提取的文本将保存在: {txt_output_dir}\n" + "="*30)
+    else:
+        output_path = output_path or os.path.join(folder_path, f"{OUTPUT_SUBFOLDER}.{output_format}")
+        print(f"提取的文本将汇总保存到: {output_path}\n" + "="*30)
+
     success_count = 0
     failure_count = 0
+    start_time = time.perf_counter()
 
-    # 遍历并处理每个图片
-    for filename in image_files:
-        filepath = os.path.join(folder_path, filename)
-        try:
-            with Image.open(filepath) as img:
-                if img.info and TEXT_BLOCK_KEY in img.info:
-                    content = img.info[TEXT_BLOCK_KEY]
-                    
-                    # 构建txt文件名并保存
-                    txt_filename = os.path.splitext(filename)[0] + ".txt"
-                    txt_filepath = os.path.join(output_dir, txt_filename)
-                    
-                    with open(txt_filepath, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                    
-                    print(f"✅ 成功: {filename} -> {txt_filename}")
-                    success_count += 1
-                # 如果图片没有文本块，则静默跳过，不提示
-        except Exception as e:
-            print(f"❌ 失败: 处理 {filename} 时出错 - {e}")
-            failure_count += 1
-            
+    with ExitStack() as stack:
+        out = writer = None
+        if txt_output_dir is None:
+            # CSV 带BOM，方便用Excel直接打开
+            out = stack.enter_context(open(output_path, 'w', newline='',
+                                           encoding='utf-8-sig' if output_format == 'csv' else 'utf-8'))
+            if output_format == 'csv':
+                writer = csv.writer(out)
+                writer.writerow(['path', 'text'])
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=jobs))
+
+        # map 按提交顺序返回结果，汇总文件中的顺序与图片顺序一致
+        results = executor.map(lambda fp: extract_one(fp, folder_path, txt_output_dir), image_files)
+        for i, (relative_path, content, error) in enumerate(results, 1):
+            if error:
+                print(f"❌ 失败: 处理 {relative_path} 时出错 - {error}")
+                failure_count += 1
+            elif content is not None:
+                success_count += 1
+                # 汇总文件中统一使用 / 作为路径分隔符
+                relative_path = relative_path.replace(os.sep, '/')
+                if writer:
+                    writer.writerow([relative_path, content])
+                elif output_format == 'jsonl':
+                    out.write(json.dumps({'path': relative_path, 'text': content}, ensure_ascii=False) + '\n')
+            # 如果图片没有文本块或不是PNG，则静默跳过，不提示
+            if i % PROGRESS_INTERVAL == 0:
+                print(f"   已处理 {i}/{len(image_files)} ...")
+
+    elapsed = time.perf_counter() - start_time
     print("="*30)
     print("处理完毕！")
-    print(f"成功提取: {success_count} 个文件")
+    print(f"成功提取: {success_count} 个文件（共扫描 {len(image_files)} 个，耗时 {elapsed:.2f}s，"
+          f"{len(image_files) / max(elapsed, 1e-6):.0f} 个/秒）")
     if failure_count > 0:
         print(f"处理失败: {failure_count} 个文件")
+    return success_count, failure_count
+
+
+def parse_args(argv):
+    """解析命令行参数；拖拽时参数就是文件路径"""
+    parser = argparse.ArgumentParser(description='提取图片中的文本块')
+    parser.add_argument('paths', nargs='*', help='图片文件（复制文本到剪贴板）或文件夹（批量提取）')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='txt',
+                        help='文件夹模式的输出格式：每张图片一个txt，或汇总为一个 jsonl/csv 文件（默认 txt）')
+    parser.add_argument('-o', '--output', help='输出路径（txt 格式时为文件夹）')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='读取文件的线程数')
+    parser.add_argument('--no-recursive', action='store_true', help='不处理子文件夹')
+    return parser.parse_args(argv)
 
 
 def main():
     """
     脚本主入口，根据启动方式判断执行哪个模式。
     """
+    args = parse_args(sys.argv[1:])
+
+    # 命令行传入文件夹时直接批量提取，不弹窗、不等待回车
+    folders = [p for p in args.paths if os.path.isdir(p)]
+    if folders:
+        for folder_path in folders:
+            print(f"已选择文件夹: {folder_path}")
+            image_files = collect_image_files(folder_path, not args.no_recursive)
+            print(f"找到 {len(image_files)} 个图片文件。")
+            extract_folder(folder_path, image_files, args.format, args.output, args.jobs)
+        return
+
     # 隐藏Tkinter的根窗口
+    import tkinter as tk
     root = tk.Tk()
     root.withdraw()
 
-    # len(sys.argv) > 1 表示有文件被拖拽到脚本上
-    if len(sys.argv) > 1:
-        handle_drag_and_drop(sys.argv[1:])
+    # 有参数表示有文件被拖拽到脚本上
+    if args.paths:
+        handle_drag_and_drop(args.paths)
     else:
-        # len(sys.argv) == 1 表示是双击运行脚本
+        # 没有参数表示是双击运行脚本
         handle_folder_selection()
 
     # 暂停脚本，方便用户查看结果
@@ -0,0 +1,397 @@
+# 文本块索引.py
+"""
+把图片中的文本块(comfy_text_block)保存到本地SQLite索引，之后搜索不必再逐张打开图片。
+同时为所有PNG文本块（parameters、prompt 等）建立倒排索引，支持按标签/短语的全文检索。
+
+索引按 路径+大小+修改时间 判断文件是否变化，更新时只重新读取新增或改动过的图片。
+需要与 提取文本块工具.py 放在同一文件夹（复用其中的PNG文本块读取函数）。
+
+用法:
+    python 文本块索引.py update 图片文件夹 [图片文件夹2 ...]   # 建立/增量更新索引
+    python 文本块索引.py search 关键词                         # 子串搜索（不区分英文大小写）
+    python 文本块索引.py regex "1girl.*smile"                  # 正则搜索
+    python 文本块索引.py dupes                                 # 文本块完全相同的图片
+    python 文本块索引.py find '1girl "long hair" OR "short hair"'  # 全文检索（标签/短语，AND/OR）
+    python 文本块索引.py stats                                 # 索引概况
+"""
+
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from 提取文本块工具 import TEXT_BLOCK_KEY, SUPPORTED_EXTENSIONS, OUTPUT_SUBFOLDER, read_png_text_chunks
+
+# -------------------- 配置 --------------------
+# 默认索引文件，放在脚本旁边
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "文本块索引.db")
+
+# 更新索引时每多少条记录提交一次
+COMMIT_INTERVAL = 2000
+
+# 搜索结果中文本块的预览长度（--full 显示全文）
+PREVIEW_LENGTH = 80
+
+# 不参与全文检索的PNG文本块：ComfyUI的 workflow 是界面节点图的JSON，
+# 提示词已经包含在 prompt 块中，索引它只会让倒排索引膨胀
+EXCLUDED_TEXT_KEYS = ['workflow']
+# ----------------------------------------------
+
+# 索引结构版本，结构变化时递增，旧索引中的图片会在下次 update 时重新读取
+SCHEMA_VERSION = 1
+
+# 分词：英文/数字按单词，中日韩文字按单字；下划线视为分隔符，所以 long_hair 与 long hair 等价
+TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')
+# 查询语法：带引号的短语，或者不含空格的词
+QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_images_text ON images(text);
+-- 图片中的全部PNG文本块（包括 comfy_text_block）
+CREATE TABLE IF NOT EXISTS chunks (
+    image_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (image_id, key)
+) WITHOUT ROWID;
+-- 倒排索引：词 -> 图片id
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    image_id INTEGER NOT NULL,
+    PRIMARY KEY (token, image_id)
+) WITHOUT ROWID;
+"""
+
+
+def tokenize(text):
+    """把文本切分为检索用的词列表（保留顺序和重复）"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def has_phrase(text, phrase):
+    """text 的词序列中是否连续出现 phrase（phrase 为空格连接的词）"""
+    return f" {phrase} " in f" {' '.join(tokenize(text))} "
+
+
+def open_index(db_path):
+    """打开（必要时创建）索引数据库"""
+    conn = sqlite3.connect(db_path)
+    # WAL 模式下更新索引时也可以同时查询
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    conn.create_function('has_phrase', 2, has_phrase, deterministic=True)
+
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        # 旧索引没有全文检索数据：把修改时间标记为无效，下次 update 会重新读取这些图片
+        if conn.execute("UPDATE images SET mtime_ns = -1").rowcount:
+            print("ℹ️ 索引结构已升级，下次 update 时会重新读取已索引的图片。")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    return conn
+
+
+def scan_files(folder_path):
+    """递归列出文件夹内的图片及其 (大小, 修改时间)，scandir 自带的stat信息不需要额外的系统调用"""
+    stack = [folder_path]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = list(os.scandir(current))
+        except OSError as e:
+            print(f"❌ 无法读取文件夹 {current}: {e}")
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name != OUTPUT_SUBFOLDER:
+                    stack.append(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS:
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def read_text_chunks(path):
+    """读取一张图片的全部PNG文本块（在工作线程中运行），返回 (路径, {键: 文本}, 错误信息或None)"""
+    try:
+        texts = read_png_text_chunks(path) or {}
+        return path, {k: v for k, v in texts.items() if k not in EXCLUDED_TEXT_KEYS}, None
+    except Exception as e:
+        return path, {}, str(e)
+
+
+def remove_postings(conn, image_id):
+    """删除一张图片的倒排索引：用旧文本重新分词，按主键删除，不需要额外的 image_id 索引"""
+    old_tokens = set()
+    for (text,) in conn.execute("SELECT text FROM chunks WHERE image_id = ?", (image_id,)):
+        old_tokens.update(tokenize(text))
+    conn.executemany("DELETE FROM postings WHERE token = ? AND image_id = ?",
+                     ((token, image_id) for token in old_tokens))
+    conn.execute("DELETE FROM chunks WHERE image_id = ?", (image_id,))
+
+
+def remove_image(conn, path):
+    """删除一张图片的记录、文本块和倒排索引（没有记录时什么也不做）"""
+    row = conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()
+    if row is None:
+        return
+    remove_postings(conn, row[0])
+    conn.execute("DELETE FROM images WHERE id = ?", (row[0],))
+
+
+def store_image(conn, path, size, mtime_ns, texts):
+    """写入（或更新）一张图片的记录、文本块和倒排索引"""
+    conn.execute(
+        "INSERT INTO images (path, size, mtime_ns, text) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, text = excluded.text",
+        (path, size, mtime_ns, texts.get(TEXT_BLOCK_KEY)))
+    image_id = conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()[0]
+    remove_postings(conn, image_id)
+    conn.executemany("INSERT INTO chunks (image_id, key, text) VALUES (?, ?, ?)",
+                     ((image_id, key, text) for key, text in texts.items()))
+    tokens = set()
+    for text in texts.values():
+        tokens.update(tokenize(text))
+    conn.executemany("INSERT INTO postings (token, image_id) VALUES (?, ?)", ((token, image_id) for token in tokens))
+
+
+def update_index(conn, folder_path, jobs=None):
+    """增量更新一个文件夹的索引：只读取新增/变化的图片，删除已不存在的记录"""
+    folder_path = os.path.abspath(folder_path)
+    prefix = os.path.join(folder_path, '')
+    start_time = time.perf_counter()
+
+    # 该文件夹下已有的记录
+    known = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in conn.execute(
+            "SELECT path, size, mtime_ns FROM images WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+    }
+
+    changed = []
+    unchanged = 0
+    for path, size, mtime_ns in scan_files(folder_path):
+        if known.pop(path, None) == (size, mtime_ns):
+            unchanged += 1
+        else:
+            changed.append((path, size, mtime_ns))
+
+    # known 中剩下的是已经被删除或移走的文件
+    for path in known:
+        remove_image(conn, path)
+
+    stats = {path: (size, mtime_ns) for path, size, mtime_ns in changed}
+    failed = 0
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for i, (path, texts, error) in enumerate(executor.map(read_text_chunks, stats), 1):
+            if error:
+                # 文件已变化但读取失败：旧记录已过时，删除它，下次更新时会当作新文件重新读取
+                print(f"❌ 读取失败: {path} - {error}")
+                remove_image(conn, path)
+                failed += 1
+                continue
+            size, mtime_ns = stats[path]
+            store_image(conn, path, size, mtime_ns, texts)
+            if i % COMMIT_INTERVAL == 0:
+                conn.commit()
+                print(f"   已读取 {i}/{len(stats)} ...")
+    conn.commit()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"✅ {folder_path}: 新增/更新 {len(changed) - failed}，未变化 {unchanged}，"
+          f"移除 {len(known)}，失败 {failed}（耗时 {elapsed:.2f}s）")
+
+
+@lru_cache(maxsize=32)
+def compile_pattern(pattern):
+    return re.compile(pattern)
+
+
+def regexp(pattern, text):
+    """SQLite 的 REGEXP 函数实现（x REGEXP y 会调用 regexp(y, x)）"""
+    if text is None:
+        return False
+    return compile_pattern(pattern).search(text) is not None
+
+
+def preview(text, full=False):
+    """搜索结果中显示的文本块"""
+    if full or len(text) <= PREVIEW_LENGTH:
+        return text
+    return text[:PREVIEW_LENGTH].replace('\n', ' ') + '...'
+
+
+def print_matches(rows, full=False):
+    """打印搜索结果"""
+    count = 0
+    for path, text in rows:
+        count += 1
+        print(f"{path}\n    {preview(text, full)}")
+    print(f"共 {count} 个结果")
+
+
+def search_substring(conn, keyword, limit=None):
+    """子串搜索，英文不区分大小写"""
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return conn.execute(
+        "SELECT path, text FROM images WHERE text LIKE ? ESCAPE '\\' ORDER BY path LIMIT ?",
+        (f"%{escaped}%", limit or -1))
+
+
+def search_regex(conn, pattern, limit=None):
+    """正则搜索（Python re 语法）"""
+    re.compile(pattern)  # 先检查语法，出错时给出清楚的异常
+    conn.create_function('REGEXP', 2, regexp, deterministic=True)
+    return conn.execute(
+        "SELECT path, text FROM images WHERE text REGEXP ? ORDER BY path LIMIT ?", (pattern, limit or -1))
+
+
+def parse_query(query):
+    """
+    解析全文检索的查询，返回 AND 组列表，每组是 OR 连接的若干短语（词列表）。
+    例: 1girl "long hair" OR "short hair"  ->  [[['1girl']], [['long', 'hair'], ['short', 'hair']]]
+    """
+    groups = []
+    join_next = False
+    for phrase, word in QUERY_PATTERN.findall(query):
+        if word == 'OR' and not phrase:
+            join_next = bool(groups)
+            continue
+        tokens = tokenize(phrase or word)
+        if not tokens:
+            continue
+        if join_next:
+            groups[-1].append(tokens)
+        else:
+            groups.append([tokens])
+        join_next = False
+    return groups
+
+
+def phrase_sql(tokens, params):
+    """一个短语的子查询：各词的倒排列表取交集，多个词时再检查是否连续出现"""
+    params.extend(tokens)
+    candidates = " INTERSECT ".join(["SELECT image_id FROM postings WHERE token = ?"] * len(tokens))
+    if len(tokens) == 1:
+        return candidates
+    params.append(' '.join(tokens))
+    return (f"SELECT image_id FROM chunks WHERE image_id IN ({candidates}) "
+            f"GROUP BY image_id HAVING max(has_phrase(text, ?))")
+
+
+def search_fulltext(conn, query, limit=None):
+    """全文检索：组与组之间为 AND，组内为 OR，引号内为短语"""
+    groups = parse_query(query)
+    if not groups:
+        raise ValueError("查询中没有可检索的词")
+    params = []
+    # SQLite 的复合查询没有优先级，所以每一层都包成子查询
+    group_sqls = [
+        " UNION ".join(f"SELECT image_id FROM ({phrase_sql(tokens, params)})" for tokens in alternatives)
+        for alternatives in groups
+    ]
+    matched = " INTERSECT ".join(f"SELECT image_id FROM ({sql})" for sql in group_sqls)
+    params.append(limit or -1)
+    # 没有 comfy_text_block 的图片显示第一个文本块
+    return conn.execute(
+        f"SELECT path, coalesce(text, (SELECT text FROM chunks WHERE image_id = images.id LIMIT 1), '') "
+        f"FROM images WHERE id IN ({matched}) ORDER BY path LIMIT ?", params)
+
+
+def find_duplicates(conn, limit=None):
+    """文本块完全相同的图片分组，返回 [(文本块, [路径...])]，按重复数量从多到少"""
+    groups = conn.execute(
+        "SELECT text, COUNT(*) AS n FROM images WHERE text IS NOT NULL AND text != '' "
+        "GROUP BY text HAVING n > 1 ORDER BY n DESC LIMIT ?", (limit or -1,)).fetchall()
+    return [
+        (text, [path for (path,) in conn.execute("SELECT path FROM images WHERE text = ? ORDER BY path", (text,))])
+        for text, _ in groups
+    ]
+
+
+def print_stats(conn):
+    """打印索引概况"""
+    total, with_text = conn.execute("SELECT COUNT(*), COUNT(text) FROM images").fetchone()
+    distinct = conn.execute("SELECT COUNT(DISTINCT text) FROM images WHERE text IS NOT NULL").fetchone()[0]
+    chunk_count = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+    token_count, posting_count = conn.execute("SELECT COUNT(DISTINCT token), COUNT(*) FROM postings").fetchone()
+    print(f"已索引图片: {total}")
+    print(f"包含文本块: {with_text}（不同的文本块 {distinct} 种）")
+    print(f"全文检索: {chunk_count} 个PNG文本块，{token_count} 个不同的词，{posting_count} 条倒排记录")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='图片文本块索引与搜索')
+    parser.add_argument('--db', default=DEFAULT_DB, help=f'索引文件路径（默认 {DEFAULT_DB}）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    update = subparsers.add_parser('update', help='建立或增量更新索引')
+    update.add_argument('folders', nargs='+', help='图片文件夹（递归处理子文件夹）')
+    update.add_argument('-j', '--jobs', type=int, default=None, help='读取图片的线程数')
+
+    for name, help_text, arg_help in (('search', '子串搜索', '要搜索的文本'), ('regex', '正则搜索', '正则表达式'),
+                                      ('find', '全文检索（所有PNG文本块）', '查询，例如 1girl "long hair" OR "short hair"')):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('query', help=arg_help)
+        sub.add_argument('--limit', type=int, default=None, help='最多显示多少个结果')
+        sub.add_argument('--full', action='store_true', help='显示完整文本块')
+
+    dupes = subparsers.add_parser('dupes', help='查找文本块完全相同的图片')
+    dupes.add_argument('--limit', type=int, default=None, help='最多显示多少组')
+    dupes.add_argument('--full', action='store_true', help='显示完整文本块')
+
+    subparsers.add_parser('stats', help='索引概况')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    conn = open_index(args.db)
+    try:
+        if args.command == 'update':
+            for folder in args.folders:
+                if not os.path.isdir(folder):
+                    print(f"❌ 不是文件夹: {folder}")
+                    continue
+                update_index(conn, folder, args.jobs)
+        elif args.command == 'search':
+            print_matches(search_substring(conn, args.query, args.limit), args.full)
+        elif args.command == 'regex':
+            try:
+                print_matches(search_regex(conn, args.query, args.limit), args.full)
+            except re.error as e:
+                print(f"❌ 正则表达式有误: {e}")
+                return 1
+        elif args.command == 'find':
+            try:
+                print_matches(search_fulltext(conn, args.query, args.limit), args.full)
+            except ValueError as e:
+                print(f"❌ {e}")
+                return 1
+        elif args.command == 'dupes':
+            groups = find_duplicates(conn, args.limit)
+            for text, paths in groups:
+                print(f"[{len(paths)} 张] {preview(text, args.full)}")
+                for path in paths:
+                    print(f"    {path}")
+            print(f"共 {len(groups)} 组重复的文本块")
+        elif args.command == 'stats':
+            print_stats(conn)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,47 @@
 import sys
 import os
+import io
+import math
+import argparse
+import csv
+import json
+from datetime import datetime
+import shutil
+import tempfile
+import subprocess
 import cv2
 import numpy as np
 import time
-from PIL import Image
+from PIL import Image, GifImagePlugin
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from sklearn.cluster import MiniBatchKMeans
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 批量模式识别的视频扩展名
+VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v']
+
+# 运动检测使用的缩略图宽度（只在这个小灰度图上计算帧差）
+MOTION_SAMPLE_WIDTH = 160
+
+# 输出格式及对应扩展名；只有GIF需要调色板量化
+OUTPUT_EXTENSIONS = {
+    'gif': '.gif',
+    'webp': '.webp',
+    'webp_lossless': '.webp',
+    'apng': '.png'
+}
+FORMAT_NAMES = {
+    'gif': 'GIF',
+    'webp': 'WebP(有损)',
+    'webp_lossless': 'WebP(无损)',
+    'apng': 'APNG'
+}
+
+# 目标大小模式：抽样估算用的片段数、每段连续帧数，以及给估算误差预留的余量
+TARGET_SAMPLE_RUNS = 4
+TARGET_SAMPLE_RUN_LENGTH = 12
+TARGET_SIZE_MARGIN = 0.9
 
 # 修改默认配置
 DEFAULT_SETTINGS = {
@@ -17,8 +52,25 @@ DEFAULT_SETTINGS = {
     'vector_colors': 16,
     'dynamic_framerate': False,
     'motion_threshold': 10,
+    'scene_cut_detection': False,
+    'scene_cut_threshold': 0.5,  # 直方图相关性低于此值视为场景切换
     'processing_order': 'efficiency',  # 'efficiency'或'quality'
-    'time_logging': True
+    'time_logging': True,
+    'collision_policy': 'ask',  # 输出已存在时: 'ask'弹窗 / 'rename' / 'overwrite' / 'skip'
+    'memory_limit_mb': 0,  # 单个任务已处理帧的缓存上限(MB)，只统计帧数据，不是整个进程的内存上限；0表示不限制
+    'optim_colors': 32,  # 颜色优化使用的颜色数
+    'target_size_mb': 0,  # 目标文件大小(MB)，0表示不启用目标大小模式
+    'delta_encoding': True,  # 差分帧编码：只写入变化区域，未变化像素设为透明
+    'delta_tolerance': 0,  # 差分帧判定阈值（各通道最大差值），0表示严格比较（无损）；大于0时差值内的像素不更新，有损
+    'output_format': 'gif',  # 'gif' / 'webp' / 'webp_lossless' / 'apng'
+    'webp_quality': 80,  # 有损WebP的质量(0-100)
+    'compare_formats': False,  # 额外把同一组帧编码为所有格式并在报告中比较大小
+    'decode_backend': 'opencv',  # 'opencv' 或 'ffmpeg'（管道解码，缩放/跳帧/转RGB在ffmpeg内完成）
+    'start_time': 0,  # 开始时间(秒)
+    'end_time': 0,  # 结束时间(秒)，0表示到视频结尾
+    'crop': None,  # 裁剪区域 (x, y, 宽, 高)，None表示不裁剪
+    'segments': [],  # 多段转换 [(开始秒, 结束秒), ...]，每段输出一个文件
+    'profile_output': ''  # 性能数据导出：''不导出，'auto'保存在输出文件旁，或指定.json/.csv路径
 }
 
 def show_settings_dialog():
@@ -35,8 +87,20 @@ def show_settings_dialog():
     var_vector_colors = tk.IntVar(value=DEFAULT_SETTINGS['vector_colors'])
     var_dynamic = tk.BooleanVar(value=DEFAULT_SETTINGS['dynamic_framerate'])
     var_threshold = tk.IntVar(value=DEFAULT_SETTINGS['motion_threshold'])
+    var_scene_cut = tk.BooleanVar(value=DEFAULT_SETTINGS['scene_cut_detection'])
     var_order = tk.StringVar(value=DEFAULT_SETTINGS['processing_order'])
     var_time_log = tk.BooleanVar(value=DEFAULT_SETTINGS['time_logging'])
+    var_target = tk.DoubleVar(value=DEFAULT_SETTINGS['target_size_mb'])
+    var_delta = tk.BooleanVar(value=DEFAULT_SETTINGS['delta_encoding'])
+    var_delta_tolerance = tk.IntVar(value=DEFAULT_SETTINGS['delta_tolerance'])
+    var_format = tk.StringVar(value=DEFAULT_SETTINGS['output_format'])
+    var_compare = tk.BooleanVar(value=DEFAULT_SETTINGS['compare_formats'])
+    var_ffmpeg = tk.BooleanVar(value=DEFAULT_SETTINGS['decode_backend'] == 'ffmpeg')
+    var_start = tk.StringVar(value="")
+    var_end = tk.StringVar(value="")
+    var_crop = tk.StringVar(value="")
+    var_segments = tk.StringVar(value="")
+    var_profile = tk.BooleanVar(value=bool(DEFAULT_SETTINGS['profile_output']))
     
     # 创建带滚动条的画布
     canvas = tk.Canvas(root)
@@ -69,11 +133,48 @@ def show_settings_dialog():
                 values=[1, 2, 3, 4, 5], 
                 width=6).grid(row=0, column=1, padx=5, sticky='w')
     
+    # 输出格式
+    frame_format = ttk.Frame(scrollable_frame)
+    frame_format.pack(fill='x', padx=10, pady=5)
+    ttk.Label(frame_format, text="输出格式:").grid(row=0, column=0, sticky='w')
+    for column, (fmt, name) in enumerate(FORMAT_NAMES.items(), 1):
+        ttk.Radiobutton(frame_format, text=name, variable=var_format, value=fmt).grid(row=0, column=column, padx=3, sticky='w')
+    ttk.Checkbutton(frame_format, text="同时比较各格式大小", variable=var_compare).grid(row=1, column=1, columnspan=3, sticky='w')
+    
+    # 解码方式
+    frame_decoder = ttk.Frame(scrollable_frame)
+    frame_decoder.pack(fill='x', padx=10, pady=5)
+    ttk.Checkbutton(frame_decoder, text="使用ffmpeg解码 (缩放和跳帧在解码器内完成，需要安装ffmpeg)", variable=var_ffmpeg).grid(row=0, column=0, sticky='w')
+    
     # 颜色优化
     frame_color = ttk.Frame(scrollable_frame)
     frame_color.pack(fill='x', padx=10, pady=5)
     ttk.Checkbutton(frame_color, text="启用32色优化", variable=var_color).grid(row=0, column=0, sticky='w')
     
+    # 目标大小选项
+    frame_target = ttk.Frame(scrollable_frame)
+    frame_target.pack(fill='x', padx=10, pady=5)
+    ttk.Label(frame_target, text="目标大小(MB):").grid(row=0, column=0, sticky='w')
+    ttk.Entry(frame_target, textvariable=var_target, width=8).grid(row=0, column=1, padx=5, sticky='w')
+    ttk.Label(frame_target, text="0为不限制；启用后自动搜索缩放/跳帧/颜色数").grid(row=0, column=2, sticky='w')
+    
+    # 片段设置区域
+    ttk.Label(scrollable_frame, text="片段设置 (留空表示整段)", font=("Arial", 10, "bold")).pack(pady=(15,5), anchor='w', padx=10)
+    
+    frame_range = ttk.Frame(scrollable_frame)
+    frame_range.pack(fill='x', padx=10, pady=5)
+    ttk.Label(frame_range, text="开始时间:").grid(row=0, column=0, sticky='w')
+    ttk.Entry(frame_range, textvariable=var_start, width=10).grid(row=0, column=1, padx=5, sticky='w')
+    ttk.Label(frame_range, text="结束时间:").grid(row=0, column=2, sticky='w')
+    ttk.Entry(frame_range, textvariable=var_end, width=10).grid(row=0, column=3, padx=5, sticky='w')
+    ttk.Label(frame_range, text="格式: 秒 / 分:秒 / 时:分:秒").grid(row=0, column=4, sticky='w')
+    ttk.Label(frame_range, text="裁剪区域:").grid(row=1, column=0, sticky='w')
+    ttk.Entry(frame_range, textvariable=var_crop, width=22).grid(row=1, column=1, columnspan=3, padx=5, sticky='w')
+    ttk.Label(frame_range, text="x,y,宽,高 (原始像素)").grid(row=1, column=4, sticky='w')
+    ttk.Label(frame_range, text="多段转换:").grid(row=2, column=0, sticky='w')
+    ttk.Entry(frame_range, textvariable=var_segments, width=22).grid(row=2, column=1, columnspan=3, padx=5, sticky='w')
+    ttk.Label(frame_range, text="如 0:03-0:06, 1:20-1:25").grid(row=2, column=4, sticky='w')
+    
     # 高级压缩选项区域
     ttk.Label(scrollable_frame, text="高级压缩选项", font=("Arial", 10, "bold")).pack(pady=(15,5), anchor='w', padx=10)
     
@@ -94,6 +195,14 @@ def show_settings_dialog():
     ttk.Scale(frame_dynamic, from_=1, to=50, variable=var_threshold, 
              orient="horizontal", length=150).grid(row=0, column=2, padx=5)
     ttk.Label(frame_dynamic, textvariable=var_threshold).grid(row=0, column=3, padx=5)
+    ttk.Checkbutton(frame_dynamic, text="检测场景切换 (切换处必定保留)", variable=var_scene_cut).grid(row=1, column=0, sticky='w')
+    
+    # 差分帧编码选项
+    frame_delta = ttk.Frame(scrollable_frame)
+    frame_delta.pack(fill='x', padx=10, pady=5)
+    ttk.Checkbutton(frame_delta, text="启用差分帧编码 (静态背景只保存一次)", variable=var_delta).grid(row=0, column=0, sticky='w')
+    ttk.Label(frame_delta, text="容差 (0为无损，增大可减小文件但有损):").grid(row=1, column=0, sticky='w')
+    ttk.Entry(frame_delta, textvariable=var_delta_tolerance, width=5).grid(row=1, column=1, padx=5, sticky='w')
     
     # 处理顺序选项
     frame_order = ttk.Frame(scrollable_frame)
@@ -101,7 +210,7 @@ def show_settings_dialog():
     ttk.Label(frame_order, text="处理顺序:").grid(row=0, column=0, sticky='w')
     ttk.Radiobutton(frame_order, text="效率优先 (先缩放和跳帧)", 
                    variable=var_order, value='efficiency').grid(row=0, column=1, padx=5, sticky='w')
-    ttk.Radiobutton(frame_order, text="质量优先 (先矢量量化)", 
+    ttk.Radiobutton(frame_order, text="质量优先 (原分辨率学习调色板)", 
                    variable=var_order, value='quality').grid(row=1, column=1, padx=5, sticky='w')
     
     # 时间记录选项
@@ -109,6 +218,7 @@ def show_settings_dialog():
     frame_time.pack(fill='x', padx=10, pady=5)
     ttk.Label(frame_time, text="时间记录:").grid(row=0, column=0, sticky='w')
     ttk.Checkbutton(frame_time, text="在控制台显示详细处理时间", variable=var_time_log).grid(row=0, column=1, sticky='w')
+    ttk.Checkbutton(frame_time, text="导出性能数据 (JSON，保存在输出文件旁)", variable=var_profile).grid(row=1, column=1, sticky='w')
     
     # 说明标签
     ttk.Label(scrollable_frame, 
@@ -121,17 +231,40 @@ def show_settings_dialog():
     ttk.Button(btn_frame, text="开始转换", command=lambda: on_confirm(), width=15).pack()
     
     def on_confirm():
-        root.settings = {
-            'frame_step': var_step.get(),
-            'color_optim': var_color.get(),
-            'scale_factor': var_scale.get(),
-            'vector_quantization': var_vector.get(),
-            'vector_colors': var_vector_colors.get(),
-            'dynamic_framerate': var_dynamic.get(),
-            'motion_threshold': var_threshold.get(),
-            'processing_order': var_order.get(),
-            'time_logging': var_time_log.get()
-        }
+        try:
+            clip_settings = {
+                'start_time': parse_time_string(var_start.get()) if var_start.get().strip() else 0,
+                'end_time': parse_time_string(var_end.get()) if var_end.get().strip() else 0,
+                'crop': parse_crop(var_crop.get()) if var_crop.get().strip() else None,
+                'segments': parse_segments(var_segments.get())
+            }
+            root.settings = {
+                **clip_settings,
+                'frame_step': var_step.get(),
+                'color_optim': var_color.get(),
+                'scale_factor': var_scale.get(),
+                'vector_quantization': var_vector.get(),
+                'vector_colors': var_vector_colors.get(),
+                'dynamic_framerate': var_dynamic.get(),
+                'motion_threshold': var_threshold.get(),
+                'scene_cut_detection': var_scene_cut.get(),
+                'processing_order': var_order.get(),
+                'time_logging': var_time_log.get(),
+                'target_size_mb': var_target.get(),
+                'delta_encoding': var_delta.get(),
+                'delta_tolerance': var_delta_tolerance.get(),
+                'output_format': var_format.get(),
+                'compare_formats': var_compare.get(),
+                'decode_backend': 'ffmpeg' if var_ffmpeg.get() else 'opencv',
+                'profile_output': 'auto' if var_profile.get() else ''
+            }
+        except tk.TclError:
+            # 数值输入框为空或不是数字时，Variable.get() 抛出 TclError
+            messagebox.showerror("设置错误", "请检查数值输入框：不能为空，且必须是数字")
+            return
+        except ValueError as e:
+            messagebox.showerror("片段设置错误", str(e))
+            return
         root.destroy()
     
     canvas.pack(side="left", fill="both", expand=True)
@@ -139,85 +272,424 @@ def show_settings_dialog():
     root.mainloop()
     return getattr(root, 'settings', None)
 
-def apply_vector_quantization(img, colors=16):
-    """应用矢量量化减少颜色数量"""
+def apply_vector_quantization(frame_rgb, colors=16, fit_pixels=None):
+    """应用矢量量化减少颜色数量，直接生成调色板(P模式)图像
+    
+    fit_pixels不为None时用它学习调色板（质量优先：来自原分辨率帧），
+    再把frame_rgb的像素映射到调色板上。
+    """
     try:
         start_time = time.perf_counter()
         
-        img_np = np.array(img)
-        h, w, c = img_np.shape
-        
-        pixels = img_np.reshape((-1, 3))
+        h, w = frame_rgb.shape[:2]
+        pixels = frame_rgb.reshape((-1, 3))
         kmeans = MiniBatchKMeans(n_clusters=colors, random_state=0, batch_size=1024)
-        kmeans.fit(pixels)
-        new_pixels = kmeans.cluster_centers_[kmeans.labels_]
-        quantized_img = new_pixels.reshape(h, w, c).astype(np.uint8)
+        if fit_pixels is None:
+            kmeans.fit(pixels)
+            labels = kmeans.labels_
+        else:
+            kmeans.fit(fit_pixels)
+            labels = kmeans.predict(pixels)
+        
+        # 标签即调色板索引，省去GIF保存时的二次量化
+        palette = np.clip(kmeans.cluster_centers_, 0, 255).astype(np.uint8)
+        img = Image.fromarray(labels.reshape(h, w).astype(np.uint8))
+        img.putpalette(palette.flatten().tolist())
         
         process_time = time.perf_counter() - start_time
-        return Image.fromarray(quantized_img), process_time
+        return img, process_time
     except Exception as e:
         print(f"矢量量化失败: {str(e)}")
-        return img, 0
+        return Image.fromarray(frame_rgb), 0
+
+def sample_palette_pixels(frame, max_pixels=65536, is_rgb=False):
+    """从原分辨率帧中等间隔抽样像素（RGB顺序），用于学习调色板"""
+    pixels = frame.reshape((-1, 3))
+    step = max(1, len(pixels) // max_pixels)
+    if is_rgb:
+        return pixels[::step]
+    # 通道反序只是视图，不做整帧颜色转换
+    return pixels[::step, ::-1]
+
+def make_motion_thumbnail(frame, is_rgb=False):
+    """生成用于运动检测的小尺寸灰度图（先缩小再转灰度，避免整帧转换）"""
+    h, w = frame.shape[:2]
+    if w > MOTION_SAMPLE_WIDTH:
+        sample_h = max(1, int(h * MOTION_SAMPLE_WIDTH / w))
+        frame = cv2.resize(frame, (MOTION_SAMPLE_WIDTH, sample_h), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY if is_rgb else cv2.COLOR_BGR2GRAY)
 
-def frame_difference(prev_frame, curr_frame):
-    """计算两帧之间的差异（均方误差）"""
+def frame_difference(prev_thumb, curr_thumb):
+    """计算两张运动检测缩略图之间的差异（均方误差）"""
     start_time = time.perf_counter()
     
-    if prev_frame is None:
+    if prev_thumb is None:
         return float('inf'), 0
     
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    curr_gray = cv2.cvtColor(curr_frame, cv2.COLOR_BGR2GRAY)
-    diff = cv2.absdiff(prev_gray, curr_gray)
-    mse = np.mean(diff ** 2)
+    # 在int32上求平方，避免uint8溢出回绕
+    diff = cv2.absdiff(prev_thumb, curr_thumb).astype(np.int32)
+    mse = float(np.mean(diff * diff))
     
     process_time = time.perf_counter() - start_time
     return mse, process_time
 
-def generate_output_path(input_path, settings):
-    """生成输出路径，处理重名文件"""
+def is_scene_cut(prev_thumb, curr_thumb, threshold):
+    """通过灰度直方图相关性判断两帧之间是否发生场景切换"""
+    if prev_thumb is None:
+        return False
+    prev_hist = cv2.calcHist([prev_thumb], [0], None, [32], [0, 256])
+    curr_hist = cv2.calcHist([curr_thumb], [0], None, [32], [0, 256])
+    return cv2.compareHist(prev_hist, curr_hist, cv2.HISTCMP_CORREL) < threshold
+
+def generate_output_path(input_path, settings, reserved=None, suffix=''):
+    """生成输出路径，按settings['collision_policy']处理重名文件
+    
+    reserved为批量模式中已分配给其他任务的路径集合，同样视为已存在。
+    suffix追加在文件名后（如多段输出的 "-片段1"）。
+    """
     dir_name = os.path.dirname(input_path)
-    base_name = os.path.splitext(os.path.basename(input_path))[0]
-    base_output = f"动图-{base_name}.gif"
+    base_name = os.path.splitext(os.path.basename(input_path))[0] + suffix
+    ext = OUTPUT_EXTENSIONS[settings.get('output_format', 'gif')]
+    base_output = f"动图-{base_name}{ext}"
     output_path = os.path.join(dir_name, base_output)
+    reserved = reserved if reserved is not None else set()
+    policy = settings.get('collision_policy', 'ask')
     
-    # 检查文件是否存在
-    counter = 1
-    while os.path.exists(output_path):
-        # 弹出对话框让用户选择
-        choice = messagebox.askyesnocancel(
-            "文件已存在",
-            f"文件 '{base_output}' 已存在。\n\n"
-            "是否要替换现有文件？\n"
-            "点击 '是' 替换，'否' 创建新文件，'取消' 中止操作。"
-        )
-        
-        if choice is None:  # 取消
+    def taken(path):
+        return os.path.exists(path) or path in reserved
+    
+    # 非交互策略
+    if policy != 'ask' and taken(output_path):
+        if policy == 'skip':
             return None
-        elif choice:  # 是 - 替换
+        if policy == 'overwrite' and output_path not in reserved:
             return output_path
-        else:  # 否 - 创建新文件
-            new_name = f"动图-{base_name}（{counter}）.gif"
-            output_path = os.path.join(dir_name, new_name)
+        counter = 1
+        while taken(output_path):
+            output_path = os.path.join(dir_name, f"动图-{base_name}（{counter}）{ext}")
             counter += 1
+        return output_path
+    
+    # 检查文件是否存在
+    counter = 1
+    while taken(output_path):
+        # 已分配给其他任务的路径不能替换（否则两个任务会同时写同一个文件），直接换下一个名字
+        if output_path not in reserved:
+            # 弹出对话框让用户选择
+            choice = messagebox.askyesnocancel(
+                "文件已存在",
+                f"文件 '{os.path.basename(output_path)}' 已存在。\n\n"
+                "是否要替换现有文件？\n"
+                "点击 '是' 替换，'否' 创建新文件，'取消' 中止操作。"
+            )
+            
+            if choice is None:  # 取消
+                return None
+            elif choice:  # 是 - 替换
+                return output_path
+        # 否 - 创建新文件
+        new_name = f"动图-{base_name}（{counter}）{ext}"
+        output_path = os.path.join(dir_name, new_name)
+        counter += 1
     
     return output_path
 
-def process_video(input_path, settings):
-    input_path = input_path.strip('"')
+def plan_output_paths(input_path, settings, reserved=None):
+    """规划一个视频的全部输出路径，返回 (输出路径, 各段输出路径)
     
-    # 初始化时间记录
-    time_stats = {
+    整段输出时各段输出路径为None。设置了多段时每段 "动图-<名>-片段N" 都单独按重名策略处理，
+    被跳过的段为None，返回的输出路径是第一个要写入的段（用于报告和性能数据命名）。
+    所有段都被跳过或用户取消时输出路径为None。分配出的路径都会加入reserved。
+    """
+    reserved = reserved if reserved is not None else set()
+    segments = settings.get('segments')
+    if not segments:
+        output_path = generate_output_path(input_path, settings, reserved)
+        if output_path is not None:
+            reserved.add(output_path)
+        return output_path, None
+    
+    segment_paths = []
+    for i in range(1, len(segments) + 1):
+        path = generate_output_path(input_path, settings, reserved, f"-片段{i}")
+        if path is None and settings.get('collision_policy', 'ask') == 'ask':
+            return None, None  # 用户取消
+        if path is not None:
+            reserved.add(path)
+        segment_paths.append(path)
+    written = [path for path in segment_paths if path]
+    return (written[0] if written else None), segment_paths
+
+def parse_time_string(text):
+    """把 '90' / '1:30' / '0:01:30.5' 形式的时间解析为秒"""
+    try:
+        seconds = 0.0
+        for part in text.strip().split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except ValueError:
+        raise ValueError(f"时间格式错误: {text}（应为 秒 / 分:秒 / 时:分:秒）")
+
+def parse_segments(text):
+    """把 '0:03-0:06, 1:20-1:25' 解析为 [(3.0, 6.0), (80.0, 85.0)]；结束时间留空表示到结尾"""
+    segments = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        start, _, end = item.partition('-')
+        segments.append((parse_time_string(start), parse_time_string(end) if end.strip() else 0))
+    return segments
+
+def parse_crop(text):
+    """把 'x,y,宽,高' 解析为整数四元组"""
+    try:
+        values = [int(v) for v in text.replace(' ', '').split(',')]
+    except ValueError:
+        values = []
+    if len(values) != 4 or values[2] <= 0 or values[3] <= 0:
+        raise ValueError(f"裁剪区域格式错误: {text}（应为 x,y,宽,高）")
+    return tuple(values)
+
+def resolve_frame_range(settings, fps, total_frames):
+    """把开始/结束时间换算为帧号区间 [start_frame, end_frame)，end_frame为None表示到结尾"""
+    if fps <= 0:
+        return 0, None
+    start_frame = int(round(settings.get('start_time', 0) * fps))
+    end_frame = int(round(settings['end_time'] * fps)) if settings.get('end_time') else None
+    if total_frames > 0:
+        if start_frame >= total_frames:
+            raise ValueError("开始时间超出视频长度")
+        if end_frame is not None:
+            end_frame = min(end_frame, total_frames)
+    if end_frame is not None and end_frame <= start_frame:
+        raise ValueError("结束时间必须晚于开始时间")
+    return start_frame, end_frame
+
+def resolve_crop(settings, width, height):
+    """把裁剪区域限制在画面范围内，返回 (x, y, 宽, 高)；未设置时返回整幅画面"""
+    if not settings.get('crop'):
+        return 0, 0, width, height
+    x, y, w, h = settings['crop']
+    x, y = max(0, min(x, width)), max(0, min(y, height))
+    w, h = min(w, width - x), min(h, height - y)
+    if w <= 0 or h <= 0:
+        raise ValueError("裁剪区域超出画面范围")
+    return x, y, w, h
+
+def compute_scaled_size(width, height, scale_factor):
+    """计算缩放后的尺寸（取偶数）；比例为1.0时保持原尺寸"""
+    if scale_factor == 1.0:
+        return width, height
+    return int(width * scale_factor) // 2 * 2, int(height * scale_factor) // 2 * 2
+
+def needs_palette(settings):
+    """GIF输出需要调色板量化；对比各格式时GIF也参与编码，同样需要量化"""
+    return settings.get('output_format', 'gif') == 'gif' or settings.get('compare_formats')
+
+def process_frame(frame, settings, scaled_size, time_stats, is_rgb=False, rgb_frames=None):
+    """对一个保留帧严格按 缩放 -> 颜色转换 -> 量化 各执行一次
+    
+    GIF输出返回P模式图像；WebP/APNG跳过量化，直接返回RGB图像。
+    is_rgb表示帧已是RGB（ffmpeg解码），此时跳过颜色转换。
+    传入rgb_frames列表时（对比各格式），量化前的RGB图像也会追加到其中。
+    """
+    # 1. 缩放处理
+    resize_start = time.perf_counter()
+    if (frame.shape[1], frame.shape[0]) != scaled_size:
+        small = cv2.resize(frame, scaled_size, interpolation=cv2.INTER_AREA)
+    else:
+        small = frame
+    resize_time = time.perf_counter() - resize_start
+    time_stats['resize'] += resize_time
+    # 不需要缩放的帧也记一个样本，样本数与保留帧数一致
+    time_stats['frame_times']['resize'].append(resize_time)
+    
+    # 2. 颜色转换（BGR -> RGB）
+    if is_rgb:
+        frame_rgb = small
+    else:
+        convert_start = time.perf_counter()
+        frame_rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        time_stats['convert'] += time.perf_counter() - convert_start
+    if rgb_frames is not None:
+        rgb_frames.append(Image.fromarray(frame_rgb))
+    
+    # 3. 量化（仅GIF）
+    if not needs_palette(settings):
+        return Image.fromarray(frame_rgb)
+    quant_start = time.perf_counter()
+    img = quantize_frame(frame_rgb, frame, settings, time_stats, is_rgb)
+    time_stats['frame_times']['quantize'].append(time.perf_counter() - quant_start)
+    
+    return img
+
+def quantize_frame(frame_rgb, source_frame, settings, time_stats, source_is_rgb=False):
+    """把RGB帧量化为P模式图像；source_frame为原分辨率帧（质量优先时用于学习调色板，可为None）"""
+    if settings['vector_quantization']:
+        vq_start = time.perf_counter()
+        # 质量优先：在原分辨率帧上学习调色板，再映射缩放后的像素
+        use_source = source_frame is not None and settings['processing_order'] == 'quality'
+        fit_pixels = sample_palette_pixels(source_frame, is_rgb=source_is_rgb) if use_source else None
+        colors = min(settings['vector_colors'], 255) if settings.get('delta_encoding') else settings['vector_colors']
+        img, _ = apply_vector_quantization(frame_rgb, colors, fit_pixels)
+        time_stats['vector_quant'] += time.perf_counter() - vq_start
+    else:
+        color_start = time.perf_counter()
+        img = Image.fromarray(frame_rgb)
+        if settings['color_optim']:
+            img = img.quantize(colors=settings.get('optim_colors', 32), method=Image.FASTOCTREE)
+        else:
+            # 差分帧编码需要空出一个调色板索引作为透明色
+            img = img.convert("P", palette=Image.ADAPTIVE, colors=255 if settings.get('delta_encoding') else 256)
+        time_stats['color_optim'] += time.perf_counter() - color_start
+    return img
+
+def new_time_stats():
+    """创建空的时间记录字典"""
+    return {
         'total': 0,
         'read': 0,
         'resize': 0,
+        'convert': 0,
         'dynamic_framerate': 0,
         'vector_quant': 0,
         'color_optim': 0,
         'save': 0,
+        'target_search': 0,
+        'target_attempts': 0,
         'frame_count': 0,
-        'processed_frames': 0
+        'decoded_frames': 0,
+        'skipped_frames': 0,
+        'scene_cuts': 0,
+        'processed_frames': 0,
+        # 逐帧耗时样本，用于导出性能数据中的分位数统计；
+        # save只有差分帧GIF逐帧编码时才有样本，其他格式由Pillow一次写完整个动图
+        'frame_times': {'read': [], 'resize': [], 'quantize': [], 'save': []}
     }
+
+def iter_frames_opencv(cap, settings, time_stats, start_frame=0, frame_limit=None, crop=None):
+    """OpenCV解码：逐帧产出 (片段内帧号(从1开始), BGR帧)；固定跳帧时被跳过的帧只grab()
+    
+    start_frame不为0时先定位到该帧（OpenCV跳到之前的关键帧再向前解码），
+    读满frame_limit帧后立即停止解码；crop为 (x, y, 宽, 高)，以视图方式裁剪不拷贝。
+    """
+    try:
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_count = 0
+        while frame_limit is None or frame_count < frame_limit:
+            frame_count += 1
+            
+            # 固定跳帧处理：被跳过的帧只grab()不retrieve()，省去颜色转换和拷贝
+            if not settings['dynamic_framerate'] and frame_count % settings['frame_step'] != 0:
+                read_start = time.perf_counter()
+                if not cap.grab():
+                    break
+                time_stats['read'] += time.perf_counter() - read_start
+                time_stats['frame_count'] += 1
+                time_stats['skipped_frames'] += 1
+                continue
+            
+            # 读取帧并计时
+            read_start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            read_time = time.perf_counter() - read_start
+            time_stats['read'] += read_time
+            time_stats['frame_times']['read'].append(read_time)
+            time_stats['frame_count'] += 1
+            time_stats['decoded_frames'] += 1
+            if crop:
+                x, y, w, h = crop
+                frame = frame[y:y + h, x:x + w]
+            yield frame_count, frame
+    finally:
+        cap.release()
+
+def iter_frames_ffmpeg(input_path, settings, scaled_size, time_stats, start_frame=0, frame_limit=None, crop=None, fps=0):
+    """ffmpeg管道解码：逐帧产出 (片段内帧号(从1开始), RGB帧)
+    
+    片段定位(-ss，关键帧定位后向前精确解码)、时长限制(-t)、裁剪、固定跳帧、
+    缩放和像素格式转换都由ffmpeg完成，Python侧不再处理整帧。
+    所有帧共用同一块缓冲区（np.frombuffer视图，不做逐帧分配），
+    调用方必须在取下一帧之前用完当前帧。
+    视频的旋转元数据会被忽略，以保证输出尺寸与OpenCV读到的尺寸一致。
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise ValueError("未找到ffmpeg，请安装ffmpeg并加入PATH，或改用OpenCV解码")
+    
+    width, height = scaled_size
+    step = 1 if settings['dynamic_framerate'] else settings['frame_step']
+    filters = []
+    if crop:
+        x, y, w, h = crop
+        filters.append(f"crop={w}:{h}:{x}:{y}")
+    if step > 1:
+        # 与OpenCV路径的保留规则一致：保留第 step, 2*step, ... 帧
+        filters.append(f"select='not(mod(n+1,{step}))'")
+    filters.append(f"scale={width}:{height}:flags=area")
+    command = [ffmpeg, '-v', 'error', '-noautorotate']
+    if start_frame and fps > 0:
+        command += ['-ss', f"{start_frame / fps:.6f}"]
+    command += ['-i', input_path]
+    if frame_limit is not None:
+        command += ['-frames:v', str(frame_limit // step)]
+    command += ['-an', '-sn', '-vf', ','.join(filters), '-vsync', '0',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    
+    frame_bytes = width * height * 3
+    buffer = bytearray(frame_bytes)
+    view = memoryview(buffer)
+    frame = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+    
+    # stderr写入临时文件而不是管道：解码期间没人读stderr，输出较多时管道写满会让ffmpeg阻塞、
+    # 进而让下面的readinto永远等不到数据
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+    kept = 0
+    try:
+        while True:
+            read_start = time.perf_counter()
+            filled = 0
+            while filled < frame_bytes:
+                n = process.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            if filled < frame_bytes:
+                break
+            read_time = time.perf_counter() - read_start
+            time_stats['read'] += read_time
+            time_stats['frame_times']['read'].append(read_time)
+            
+            kept += 1
+            time_stats['frame_count'] = kept * step
+            time_stats['decoded_frames'] = kept
+            time_stats['skipped_frames'] = kept * step - kept
+            yield kept * step, frame
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        stderr_file.seek(0)
+        error = stderr_file.read().decode('utf-8', 'replace').strip()
+        stderr_file.close()
+    
+    if kept == 0 and error:
+        raise ValueError(f"ffmpeg解码失败: {error}")
+
+def process_video(input_path, settings, rgb_frames=None):
+    """解码并处理全部保留帧，返回 (帧列表, 逐帧时长, 时间记录)
+    
+    传入rgb_frames列表时，每个保留帧量化前的RGB图像也会追加到其中（用于对比各格式）。
+    """
+    input_path = input_path.strip('"')
+    
+    # 初始化时间记录
+    time_stats = new_time_stats()
     
     # 开始总计时
     total_start_time = time.perf_counter()
@@ -232,100 +704,102 @@ def process_video(input_path, settings):
     original_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     original_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     
-    # 计算缩放尺寸
-    scaled_width = int(original_width * settings['scale_factor']) // 2 * 2
-    scaled_height = int(original_height * settings['scale_factor']) // 2 * 2
+    # 片段区间与裁剪区域
+    try:
+        start_frame, end_frame = resolve_frame_range(settings, fps, total_frames)
+        crop = resolve_crop(settings, original_width, original_height)
+    except ValueError:
+        cap.release()
+        raise
+    frame_limit = end_frame - start_frame if end_frame is not None else None
+    clip_frames = (end_frame or total_frames) - start_frame
+    if crop == (0, 0, original_width, original_height):
+        crop = None
+    
+    # 计算缩放尺寸（基于裁剪后的画面）
+    crop_width, crop_height = (crop[2], crop[3]) if crop else (original_width, original_height)
+    scaled_size = compute_scaled_size(crop_width, crop_height, settings['scale_factor'])
+    
+    # 选择解码方式
+    use_ffmpeg = settings.get('decode_backend') == 'ffmpeg'
+    if use_ffmpeg:
+        cap.release()
+        source = iter_frames_ffmpeg(input_path, settings, scaled_size, time_stats,
+                                    start_frame, frame_limit, crop, fps)
+    else:
+        source = iter_frames_opencv(cap, settings, time_stats, start_frame, frame_limit, crop)
     
     frames = []
-    frame_count = 0
-    prev_frame = None
-    last_processed_frame = None
+    kept_indices = []
+    last_thumb = None
     
-    # 处理每一帧
-    while True:
-        # 读取帧并计时
-        read_start = time.perf_counter()
-        ret, frame = cap.read()
-        if not ret:
-            break
-        time_stats['read'] += time.perf_counter() - read_start
-        time_stats['frame_count'] += 1
-        frame_count += 1
-        
-        # 动态帧率处理
-        dynamic_time = 0
-        skip_frame = False
-        if settings['dynamic_framerate']:
-            dyn_start = time.perf_counter()
-            if last_processed_frame is not None:
-                motion, motion_time = frame_difference(last_processed_frame, frame)
-                dynamic_time += motion_time
-                if motion < settings['motion_threshold']:
-                    skip_frame = True
-            time_stats['dynamic_framerate'] += time.perf_counter() - dyn_start
-        
-        if skip_frame:
-            continue
-        
-        # 固定跳帧处理
-        if not settings['dynamic_framerate'] and frame_count % settings['frame_step'] != 0:
-            continue
-        
-        # 更新最后处理的帧
-        if settings['dynamic_framerate']:
-            last_processed_frame = frame.copy()
-        
-        # 处理顺序：质量优先（先矢量量化）
-        if settings['processing_order'] == 'quality' and settings['vector_quantization']:
-            vq_start = time.perf_counter()
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            img, vq_time = apply_vector_quantization(img, settings['vector_colors'])
-            time_stats['vector_quant'] += vq_time + (time.perf_counter() - vq_start)
-        
-        # 缩放处理
-        resize_start = time.perf_counter()
-        if settings['scale_factor'] != 1.0:
-            frame = cv2.resize(frame, (scaled_width, scaled_height), interpolation=cv2.INTER_AREA)
-        time_stats['resize'] += time.perf_counter() - resize_start
-        
-        # 处理顺序：效率优先（后矢量量化）
-        if settings['processing_order'] == 'efficiency' and settings['vector_quantization']:
-            vq_start = time.perf_counter()
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            img, vq_time = apply_vector_quantization(img, settings['vector_colors'])
-            time_stats['vector_quant'] += vq_time + (time.perf_counter() - vq_start)
-        else:
-            # 转换为PIL图像
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-        
-        # 颜色优化处理
-        color_start = time.perf_counter()
-        if not settings['vector_quantization']:
-            if settings['color_optim']:
-                img = img.quantize(colors=32, method=Image.FASTOCTREE)
-            else:
-                img = img.convert("P", palette=Image.ADAPTIVE)
-        time_stats['color_optim'] += time.perf_counter() - color_start
-        
-        frames.append(img)
-        time_stats['processed_frames'] += 1
+    memory_limit = settings.get('memory_limit_mb', 0) * 1024 * 1024
+    frames_bytes = 0
     
-    cap.release()
+    # 处理每一帧
+    try:
+        for frame_count, frame in source:
+            # 动态帧率处理（只与上一保留帧的缩略图比较）
+            if settings['dynamic_framerate']:
+                dyn_start = time.perf_counter()
+                thumb = make_motion_thumbnail(frame, use_ffmpeg)
+                skip_frame = False
+                if last_thumb is not None:
+                    motion, _ = frame_difference(last_thumb, thumb)
+                    if motion < settings['motion_threshold']:
+                        skip_frame = True
+                    if settings['scene_cut_detection'] and is_scene_cut(last_thumb, thumb, settings['scene_cut_threshold']):
+                        time_stats['scene_cuts'] += 1
+                        skip_frame = False
+                time_stats['dynamic_framerate'] += time.perf_counter() - dyn_start
+                
+                if skip_frame:
+                    continue
+                last_thumb = thumb
+            
+            img = process_frame(frame, settings, scaled_size, time_stats, use_ffmpeg, rgb_frames)
+            frames.append(img)
+            kept_indices.append(frame_count)
+            time_stats['processed_frames'] += 1
+            
+            # 单任务帧缓存上限：只累计保留帧(及对比格式时的RGB帧)的像素字节数，不含解码、编码等其他内存；
+            # 超出时中止该任务，而不是拖垮整个批处理
+            if memory_limit:
+                frames_bytes += img.width * img.height * len(img.getbands())
+                if rgb_frames is not None:
+                    frames_bytes += img.width * img.height * 3
+                if frames_bytes > memory_limit:
+                    raise MemoryError(f"帧缓存超过上限 {settings['memory_limit_mb']} MB，"
+                                      f"请调小缩放比例或增大跳帧步长")
+    finally:
+        source.close()
     
     if not frames:
         raise ValueError("未提取到有效帧")
     
-    # 计算实际帧率
-    actual_fps = fps / settings['frame_step'] if not settings['dynamic_framerate'] and settings['frame_step'] > 1 else fps
-    duration = int(1000 / actual_fps) if actual_fps > 0 else 100
+    # ffmpeg的select滤镜会丢掉末尾不足一个步长的帧，按容器记录的片段帧数补齐统计
+    if use_ffmpeg and clip_frames > time_stats['frame_count']:
+        time_stats['skipped_frames'] += clip_frames - time_stats['frame_count']
+        time_stats['frame_count'] = clip_frames
+    
+    # 按每个保留帧在原视频中覆盖的时长计算逐帧时长，动态帧率丢帧后播放速度不变
+    durations = compute_frame_durations(kept_indices, time_stats['frame_count'], fps)
     
     # 结束总计时
     time_stats['total'] = time.perf_counter() - total_start_time
     
-    return frames, duration, time_stats
+    return frames, durations, time_stats
+
+def compute_frame_durations(kept_indices, total_frames, fps):
+    """根据保留帧的原始帧号计算每帧显示时长(毫秒)
+    
+    GIF时长以10ms为单位，这里按累计时间戳取整，避免误差随帧数累积；
+    低于20ms的时长会被浏览器当作100ms播放，因此下限取20ms。
+    """
+    frame_ms = 1000 / fps if fps > 0 else 100
+    boundaries = kept_indices + [max(total_frames, kept_indices[-1]) + 1]
+    stamps = [round((index - boundaries[0]) * frame_ms / 10) * 10 for index in boundaries]
+    return [max(20, stamps[i + 1] - stamps[i]) for i in range(len(kept_indices))]
 
 def format_time(seconds):
     """格式化时间显示"""
@@ -346,15 +820,19 @@ def print_time_report(time_stats, settings):
     print(f"\n=== 详细处理时间报告 ===")
     print(f"总帧数: {time_stats['frame_count']}")
     print(f"处理帧数: {time_stats['processed_frames']}")
+    print(f"解码帧数: {time_stats['decoded_frames']} (跳过未解码: {time_stats['skipped_frames']})")
     print(f"处理顺序: {'效率优先' if settings['processing_order'] == 'efficiency' else '质量优先'}")
     
     print(f"\n--- 时间统计 ---")
     print(f"总耗时: {format_time(time_stats['total'])}")
     print(f"读取视频: {format_time(time_stats['read'])} ({time_stats['read']/time_stats['total']*100:.1f}%)")
     print(f"缩放处理: {format_time(time_stats['resize'])} ({time_stats['resize']/time_stats['total']*100:.1f}%)")
+    print(f"颜色转换: {format_time(time_stats['convert'])} ({time_stats['convert']/time_stats['total']*100:.1f}%)")
     
     if settings['dynamic_framerate']:
         print(f"动态帧率: {format_time(time_stats['dynamic_framerate'])} ({time_stats['dynamic_framerate']/time_stats['total']*100:.1f}%)")
+        if settings['scene_cut_detection']:
+            print(f"  - 场景切换: {time_stats['scene_cuts']} 处")
     
     if settings['vector_quantization']:
         print(f"矢量量化: {format_time(time_stats['vector_quant'])} ({time_stats['vector_quant']/time_stats['total']*100:.1f}%)")
@@ -362,9 +840,29 @@ def print_time_report(time_stats, settings):
         print(f"  - 平均每帧: {format_time(avg_vq)}")
     
     print(f"颜色优化: {format_time(time_stats['color_optim'])} ({time_stats['color_optim']/time_stats['total']*100:.1f}%)")
-    print(f"保存GIF: {format_time(time_stats['save'])} ({time_stats['save']/time_stats['total']*100:.1f}%)")
+    print(f"保存{FORMAT_NAMES[settings.get('output_format', 'gif')]}: {format_time(time_stats['save'])} ({time_stats['save']/time_stats['total']*100:.1f}%)")
+    if 'output_size' in time_stats:
+        print(f"输出大小: {time_stats['output_size'] / 1024 / 1024:.2f} MB")
+    
+    if time_stats.get('format_sizes'):
+        print(f"\n--- 格式大小对比 ---")
+        gif_size = time_stats['format_sizes'].get('gif')
+        for output_format, size in time_stats['format_sizes'].items():
+            ratio = f" (GIF的{size / gif_size * 100:.0f}%)" if gif_size else ""
+            print(f"{FORMAT_NAMES[output_format]}: {size / 1024 / 1024:.2f} MB{ratio}")
+    
+    if settings.get('target_size_mb'):
+        print(f"\n--- 目标大小 ---")
+        print(f"目标: {settings['target_size_mb']} MB，参数搜索: {format_time(time_stats['target_search'])} "
+              f"({time_stats['target_attempts']} 次估算)")
+        colors = settings['vector_colors'] if settings['vector_quantization'] else (
+            settings['optim_colors'] if settings['color_optim'] else 256)
+        print(f"选定参数: 缩放 {settings['scale_factor']}，跳帧 {settings['frame_step']}，颜色 {colors}")
     
     print(f"\n--- 性能指标 ---")
+    peak_rss = get_peak_rss_mb()
+    if peak_rss is not None:
+        print(f"峰值内存: {peak_rss:.0f} MB")
     if time_stats['processed_frames'] > 0:
         fps = time_stats['processed_frames'] / time_stats['total']
         print(f"处理速度: {fps:.1f} FPS")
@@ -372,12 +870,26 @@ def print_time_report(time_stats, settings):
     
     print("="*40)
 
-def save_gif(frames, duration, output_path):
-    """保存GIF文件并计时"""
+def save_gif(frames, duration, output_path, settings=None, frame_times=None):
+    """保存GIF文件并计时（duration可以是统一时长或逐帧时长列表）
+    
+    差分帧编码时，若传入frame_times列表则记录每帧的编码耗时。
+    """
     save_start = time.perf_counter()
     
+    if settings and settings.get('delta_encoding'):
+        if isinstance(duration, (int, float)):
+            duration = [duration] * len(frames)
+        if hasattr(output_path, 'write'):
+            write_delta_gif(frames, duration, output_path, settings['delta_tolerance'], frame_times)
+        else:
+            with open(output_path, 'wb') as f:
+                write_delta_gif(frames, duration, f, settings['delta_tolerance'], frame_times)
+        return time.perf_counter() - save_start
+    
     frames[0].save(
         output_path,
+        format='GIF',
         save_all=True,
         append_images=frames[1:],
         duration=duration,
@@ -387,6 +899,564 @@ def save_gif(frames, duration, output_path):
     
     return time.perf_counter() - save_start
 
+def save_animation(frames, durations, output_path, settings, frame_times=None):
+    """按settings['output_format']保存动图并计时"""
+    output_format = settings.get('output_format', 'gif')
+    if output_format == 'gif':
+        return save_gif(frames, durations, output_path, settings, frame_times)
+    
+    save_start = time.perf_counter()
+    if output_format == 'apng':
+        options = {'format': 'PNG', 'disposal': 0, 'blend': 0}
+    else:
+        options = {'format': 'WEBP', 'lossless': output_format == 'webp_lossless',
+                   'quality': settings['webp_quality'], 'method': 4}
+    frames[0].save(
+        output_path,
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=0,
+        **options
+    )
+    return time.perf_counter() - save_start
+
+def compare_format_sizes(rgb_frames, palette_frames, durations, settings):
+    """把同一组帧编码为每种格式（写入内存），返回 {格式: 字节数}
+    
+    GIF直接使用处理管线中已量化的palette_frames，其他格式使用量化前的rgb_frames，这里不再量化。
+    """
+    sizes = {}
+    for output_format in OUTPUT_EXTENSIONS:
+        format_settings = {**settings, 'output_format': output_format, 'compare_formats': False}
+        encode_frames = palette_frames if output_format == 'gif' else rgb_frames
+        buffer = io.BytesIO()
+        save_animation(encode_frames, durations, buffer, format_settings)
+        sizes[output_format] = buffer.tell()
+    return sizes
+
+def write_delta_gif(frames, durations, fp, tolerance, frame_times=None):
+    """差分帧GIF编码
+    
+    维护播放器实际显示的画布，每帧只写出相对画布有变化的矩形区域，
+    区域内未变化（各通道差值不超过tolerance）的像素填为透明色，
+    所有帧使用disposal=1（保留上一帧），完全不变的帧直接并入上一帧的时长。
+    """
+    def palette_of(img):
+        return np.array(img.getpalette(), dtype=np.int16).reshape(-1, 3)
+    
+    def as_palette_image(img):
+        return img if img.mode == 'P' else img.convert('P', palette=Image.ADAPTIVE, colors=255)
+    
+    frame_start = time.perf_counter()
+    first = as_palette_image(frames[0])
+    canvas = palette_of(first)[np.asarray(first)]
+    
+    header, _ = GifImagePlugin.getheader(first, info={'loop': 0, 'duration': durations[0]})
+    for block in header:
+        fp.write(block)
+    
+    # 上一个待写出的帧：(图像, 偏移, 附加参数, 时长)；时长可能还会被后续的重复帧延长
+    pending = (first, (0, 0), {}, durations[0])
+    if frame_times is not None:
+        frame_times.append(time.perf_counter() - frame_start)
+    
+    for img, duration in zip(frames[1:], durations[1:]):
+        frame_start = time.perf_counter()
+        img = as_palette_image(img)
+        indices = np.asarray(img)
+        palette = palette_of(img)
+        current = palette[indices]
+        
+        changed = np.abs(current - canvas).max(axis=2) > tolerance
+        rows = np.flatnonzero(changed.any(axis=1))
+        if rows.size == 0:
+            pending = pending[:3] + (pending[3] + duration,)
+            if frame_times is not None:
+                frame_times.append(time.perf_counter() - frame_start)
+            continue
+        cols = np.flatnonzero(changed.any(axis=0))
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        
+        crop = indices[top:bottom, left:right].copy()
+        mask = changed[top:bottom, left:right]
+        params = {'include_color_table': True}
+        
+        # 取第一个未使用的调色板索引作为透明色；调色板已满时整块写出
+        transparent = int(indices.max()) + 1
+        if transparent < 256:
+            crop[~mask] = transparent
+            params['transparency'] = transparent
+            region_palette = palette[:transparent].flatten().tolist() + [0, 0, 0]
+        else:
+            mask = np.ones_like(mask)
+            region_palette = palette.flatten().tolist()
+        canvas[top:bottom, left:right][mask] = current[top:bottom, left:right][mask]
+        
+        region = Image.fromarray(crop)
+        region.putpalette(region_palette)
+        
+        image, offset, extra, pending_duration = pending
+        for block in GifImagePlugin.getdata(image, offset, duration=pending_duration, disposal=1, **extra):
+            fp.write(block)
+        pending = (region, (int(left), int(top)), params, duration)
+        if frame_times is not None:
+            frame_times.append(time.perf_counter() - frame_start)
+    
+    image, offset, extra, pending_duration = pending
+    for block in GifImagePlugin.getdata(image, offset, duration=pending_duration, disposal=1, **extra):
+        fp.write(block)
+    fp.write(b";")
+
+def collect_video_files(paths):
+    """把拖入的文件和文件夹展开为视频文件列表（文件夹只扫描第一层）"""
+    video_files = []
+    for path in paths:
+        path = path.strip('"')
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                file_path = os.path.join(path, filename)
+                if os.path.isfile(file_path) and os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS:
+                    video_files.append(file_path)
+        elif os.path.isfile(path):
+            video_files.append(path)
+    return video_files
+
+def convert_job(input_path, output_path, settings, segment_paths=None, peak_rss_scope='worker'):
+    """批量模式中的单个转换任务（在工作进程中运行）"""
+    result = {
+        'input': input_path,
+        'output': output_path,
+        'status': 'failed',
+        'error': None,
+        'time_stats': None,
+        'size': 0
+    }
+    try:
+        time_stats, used_settings = convert_video(input_path, output_path, settings, segment_paths)
+        profile = build_profile(input_path, time_stats, used_settings, peak_rss_scope)
+        if settings.get('profile_output') == 'auto':
+            write_profile([profile], resolve_profile_path(settings, output_path))
+        result.update(status='ok', time_stats=time_stats, size=time_stats['output_size'], profile=profile)
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+def batch_convert(video_files, settings, jobs=None):
+    """用进程池批量转换多个视频，输出路径在主进程中统一分配"""
+    jobs = jobs or max(1, (os.cpu_count() or 2) // 2)
+    
+    # 先在主进程中规划所有输出路径，避免多个任务抢同一个文件名
+    reserved = set()
+    planned = []
+    results = []
+    for input_path in video_files:
+        # 多段输出时每一段都按重名策略分配并占用路径
+        output_path, segment_paths = plan_output_paths(input_path, settings, reserved)
+        if output_path is None:
+            results.append({'input': input_path, 'output': None, 'status': 'skipped',
+                            'error': None, 'time_stats': None, 'size': 0})
+            continue
+        planned.append((input_path, output_path, segment_paths))
+    
+    # 导出性能数据时每个任务用新的工作进程，峰值内存才是单个任务的；
+    # max_tasks_per_child需要Python 3.11+，更早的版本复用进程，峰值内存标记为工作进程累计值
+    executor_options = {}
+    peak_rss_scope = 'worker'
+    if settings.get('profile_output') and sys.version_info >= (3, 11):
+        executor_options['max_tasks_per_child'] = 1
+        peak_rss_scope = 'process'
+    
+    print(f"✅ 找到 {len(video_files)} 个视频文件，待转换 {len(planned)} 个，工作进程 {jobs} 个")
+    batch_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, **executor_options) as executor:
+        future_to_file = {executor.submit(convert_job, inp, out, settings, segs, peak_rss_scope): (inp, out)
+                          for inp, out, segs in planned}
+        for done, future in enumerate(as_completed(future_to_file), 1):
+            input_path, output_path = future_to_file[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 工作进程异常退出（例如被系统因内存不足杀掉）
+                result = {'input': input_path, 'output': output_path, 'status': 'failed',
+                          'error': str(e), 'time_stats': None, 'size': 0}
+            results.append(result)
+            name = os.path.basename(input_path)
+            if result['status'] == 'ok':
+                print(f"[{done}/{len(planned)}] ✅ {name} -> {os.path.basename(output_path)} "
+                      f"({result['size'] / 1024 / 1024:.2f} MB)")
+            else:
+                print(f"[{done}/{len(planned)}] ❌ {name}: {result['error']}")
+    
+    print_batch_report(results, time.perf_counter() - batch_start)
+    
+    # 指定了路径时，把所有任务的性能数据写入同一个文件
+    if settings.get('profile_output') not in ('', 'auto', None):
+        profiles = [r['profile'] for r in results if r.get('profile')]
+        if profiles:
+            write_profile(profiles, settings['profile_output'])
+            print(f"性能数据已保存到: {settings['profile_output']}")
+    return results
+
+def print_batch_report(results, wall_time):
+    """在控制台打印批量转换的汇总时间报告"""
+    ok = [r for r in results if r['status'] == 'ok']
+    failed = [r for r in results if r['status'] == 'failed']
+    skipped = [r for r in results if r['status'] == 'skipped']
+    job_time = sum(r['time_stats']['total'] + r['time_stats']['save'] for r in ok)
+    total_frames = sum(r['time_stats']['frame_count'] for r in ok)
+    processed_frames = sum(r['time_stats']['processed_frames'] for r in ok)
+    total_size = sum(r['size'] for r in ok)
+    
+    print(f"\n=== 批量转换报告 ===")
+    print(f"成功: {len(ok)}  失败: {len(failed)}  跳过: {len(skipped)}")
+    print(f"总帧数: {total_frames}")
+    print(f"处理帧数: {processed_frames}")
+    print(f"输出总大小: {total_size / 1024 / 1024:.2f} MB")
+    
+    print(f"\n--- 时间统计 ---")
+    print(f"实际耗时: {format_time(wall_time)}")
+    print(f"任务耗时合计: {format_time(job_time)}")
+    if wall_time > 0:
+        print(f"并行加速比: {job_time / wall_time:.2f}x")
+        print(f"吞吐量: {processed_frames / wall_time:.1f} FPS")
+    
+    for r in failed:
+        print(f"❌ {os.path.basename(r['input'])}: {r['error']}")
+    print("="*40)
+
+def parse_args(argv):
+    """解析命令行参数（拖放文件时也走这里）"""
+    parser = argparse.ArgumentParser(description='视频转GIF工具')
+    parser.add_argument('paths', nargs='+', help='视频文件或包含视频的文件夹，可传入多个')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='并行工作进程数（默认CPU核数的一半）')
+    parser.add_argument('--on-exist', choices=['ask', 'rename', 'overwrite', 'skip'], default=None,
+                        help='输出文件已存在时的处理方式（批量默认rename，单文件默认ask）')
+    parser.add_argument('--format', choices=list(OUTPUT_EXTENSIONS), default=DEFAULT_SETTINGS['output_format'],
+                        help='输出格式：gif / webp(有损) / webp_lossless / apng')
+    parser.add_argument('--compare-formats', action='store_true', help='额外编码所有格式并在报告中比较大小')
+    parser.add_argument('--decoder', choices=['opencv', 'ffmpeg'], default=DEFAULT_SETTINGS['decode_backend'],
+                        help='解码方式：opencv，或ffmpeg管道（缩放和跳帧在解码器内完成）')
+    parser.add_argument('--start', type=parse_time_string, default=0, help='开始时间（秒 / 分:秒 / 时:分:秒）')
+    parser.add_argument('--end', type=parse_time_string, default=0, help='结束时间，默认到视频结尾')
+    parser.add_argument('--crop', type=parse_crop, default=None, help='裁剪区域 x,y,宽,高（原始像素）')
+    parser.add_argument('--segments', type=parse_segments, default=[],
+                        help='多段转换，每段输出一个文件，如 "0:03-0:06,1:20-1:25"')
+    parser.add_argument('--profile', nargs='?', const='auto', default=DEFAULT_SETTINGS['profile_output'],
+                        help='导出性能数据；不带路径时保存在输出文件旁(.profile.json)，路径以.csv结尾时写CSV')
+    parser.add_argument('--target-size', type=float, default=DEFAULT_SETTINGS['target_size_mb'],
+                        help='目标文件大小(MB)，自动搜索缩放/跳帧/颜色数，0表示不启用')
+    parser.add_argument('--delta-tolerance', type=int, default=DEFAULT_SETTINGS['delta_tolerance'],
+                        help='差分帧容差（各通道最大差值），默认0为无损；大于0时变化不超过该值的像素不更新')
+    parser.add_argument('--memory-limit', type=int, default=DEFAULT_SETTINGS['memory_limit_mb'],
+                        help='单个任务已处理帧的缓存上限(MB)，只统计帧数据，不限制进程总内存；0表示不限制')
+    return parser.parse_args(argv)
+
+def decode_sample_runs(input_path, settings):
+    """在片段范围内均匀抽取若干段连续帧，裁剪并缩放到当前比例后缓存，供每次估算复用
+    
+    返回 (抽样片段列表, 片段总帧数, 裁剪后的原始尺寸)。
+    """
+    cap = cv2.VideoCapture(input_path.strip('"'))
+    if not cap.isOpened():
+        raise ValueError("无法打开视频文件")
+    
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    try:
+        start_frame, end_frame = resolve_frame_range(settings, fps, total_frames)
+        x, y, w, h = resolve_crop(settings, width, height)
+    except ValueError:
+        cap.release()
+        raise
+    clip_frames = (end_frame or total_frames) - start_frame
+    original_size = (w, h)
+    base_size = compute_scaled_size(w, h, settings['scale_factor'])
+    
+    run_length = min(TARGET_SAMPLE_RUN_LENGTH, max(1, clip_frames))
+    span = max(0, clip_frames - run_length)
+    starts = sorted({start_frame + span * i // max(1, TARGET_SAMPLE_RUNS - 1) for i in range(TARGET_SAMPLE_RUNS)})
+    
+    runs = []
+    for start in starts:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        run = []
+        for _ in range(run_length):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = frame[y:y + h, x:x + w]
+            if base_size != original_size:
+                frame = cv2.resize(frame, base_size, interpolation=cv2.INTER_AREA)
+            run.append(frame)
+        if run:
+            runs.append(run)
+    cap.release()
+    
+    if not runs:
+        raise ValueError("未提取到有效帧")
+    return runs, clip_frames, original_size
+
+def build_target_candidates(settings):
+    """生成候选参数 (缩放比例, 跳帧步长, 颜色数)，按预计输出大小从大到小排序
+    
+    候选不会超出用户已选的上限：缩放不大于当前比例，跳帧不小于当前步长，颜色数不多于当前颜色数。
+    """
+    base_scale = settings['scale_factor']
+    scales = sorted({base_scale, *(s for s in (1.0, 0.75, 0.5, 0.33, 0.25, 0.2, 0.15) if s < base_scale)},
+                    reverse=True)
+    
+    # 动态帧率自行决定保留哪些帧，此时只搜索缩放和颜色
+    if settings['dynamic_framerate']:
+        steps = [1]
+    else:
+        steps = list(range(settings['frame_step'], settings['frame_step'] + 4))
+    
+    if settings['vector_quantization']:
+        max_colors = settings['vector_colors']
+    elif settings['color_optim']:
+        max_colors = settings['optim_colors']
+    else:
+        max_colors = 256
+    # WebP/APNG不做量化，颜色数不参与搜索
+    if settings.get('output_format', 'gif') != 'gif':
+        colors = [max_colors]
+    else:
+        colors = [c for c in (256, 128, 64, 32, 16, 8) if c <= max_colors] or [max_colors]
+    
+    candidates = [(scale, step, c) for scale in scales for step in steps for c in colors]
+    # 每秒像素数 × 每像素位数，作为输出大小的单调代理
+    candidates.sort(key=lambda cand: cand[0] ** 2 / cand[1] * math.log2(cand[2]), reverse=True)
+    return candidates
+
+def apply_candidate(settings, candidate):
+    """把候选参数写回设置字典（返回新字典）"""
+    scale, step, colors = candidate
+    tuned = {**settings, 'scale_factor': scale, 'frame_step': step}
+    if settings['vector_quantization']:
+        tuned['vector_colors'] = colors
+    elif colors >= 256:
+        tuned['color_optim'] = False
+    else:
+        tuned.update(color_optim=True, optim_colors=colors)
+    return tuned
+
+def estimate_output_size(runs, original_size, total_frames, settings, scaled_cache):
+    """用抽样片段编码出的字节数外推整段动图的大小"""
+    scaled_size = compute_scaled_size(*original_size, settings['scale_factor'])
+    
+    # 同一缩放比例的缩略帧只生成一次，在各次尝试之间复用
+    if scaled_size not in scaled_cache:
+        scaled_cache[scaled_size] = [
+            [f if (f.shape[1], f.shape[0]) == scaled_size
+             else cv2.resize(f, scaled_size, interpolation=cv2.INTER_AREA) for f in run]
+            for run in runs
+        ]
+    
+    step = settings['frame_step']
+    stats = new_time_stats()
+    # 估算只关心最终输出格式，不需要为格式对比额外量化
+    settings = {**settings, 'compare_formats': False}
+    sample_bytes = 0
+    sample_frames = 0
+    for run in scaled_cache[scaled_size]:
+        imgs = [process_frame(f, settings, scaled_size, stats) for f in run[step - 1::step]]
+        if not imgs:
+            continue
+        buffer = io.BytesIO()
+        save_animation(imgs, [100] * len(imgs), buffer, settings)
+        sample_bytes += buffer.tell()
+        sample_frames += len(imgs)
+    
+    if not sample_frames:
+        return float('inf')
+    return sample_bytes / sample_frames * max(1, total_frames // step)
+
+def search_target_settings(input_path, settings, time_stats):
+    """二分搜索候选参数，找出预计不超过目标大小的最高质量参数"""
+    search_start = time.perf_counter()
+    target_bytes = settings['target_size_mb'] * 1024 * 1024 * TARGET_SIZE_MARGIN
+    runs, total_frames, original_size = decode_sample_runs(input_path, settings)
+    candidates = build_target_candidates(settings)
+    
+    scaled_cache = {}
+    best = len(candidates) - 1
+    lo, hi = 0, len(candidates) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        estimate = estimate_output_size(runs, original_size, total_frames,
+                                     apply_candidate(settings, candidates[mid]), scaled_cache)
+        time_stats['target_attempts'] += 1
+        if estimate <= target_bytes:
+            best = mid
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    
+    time_stats['target_search'] += time.perf_counter() - search_start
+    return candidates, best
+
+def merge_time_stats(a, b):
+    """把两份时间记录相加（多段转换时汇总各段）：数值相加，列表拼接，字典逐项合并"""
+    merged = dict(a)
+    for key, value in b.items():
+        if isinstance(value, dict):
+            merged[key] = merge_time_stats(a.get(key, {}), value)
+        elif isinstance(value, list):
+            merged[key] = a.get(key, []) + value
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            merged[key] = a.get(key, 0) + value
+        else:
+            merged[key] = value
+    return merged
+
+def convert_video(input_path, output_path, settings, segment_paths=None):
+    """完整转换一个视频：(目标大小搜索) -> 处理全部帧 -> 保存GIF，返回时间记录和实际使用的设置
+    
+    设置了多段时，每段单独定位、解码并输出到segment_paths中对应的路径（由plan_output_paths按重名策略规划，
+    为None的段跳过）；未传入时输出为 "<输出名>-片段N<扩展名>"。返回各段汇总的时间记录。
+    """
+    if settings.get('segments'):
+        if segment_paths is None:
+            base, ext = os.path.splitext(output_path)
+            segment_paths = [f"{base}-片段{i}{ext}" for i in range(1, len(settings['segments']) + 1)]
+        merged, outputs = None, []
+        for (start, end), segment_path in zip(settings['segments'], segment_paths):
+            if segment_path is None:
+                continue
+            segment_settings = {**settings, 'segments': [], 'start_time': start, 'end_time': end}
+            time_stats, used_settings = convert_video(input_path, segment_path, segment_settings)
+            outputs.append(segment_path)
+            merged = time_stats if merged is None else merge_time_stats(merged, time_stats)
+        merged['outputs'] = outputs
+        return merged, used_settings
+    
+    search_stats = new_time_stats()
+    candidates, index = None, None
+    if settings.get('target_size_mb'):
+        candidates, index = search_target_settings(input_path, settings, search_stats)
+        settings = apply_candidate(settings, candidates[index])
+    
+    while True:
+        # 对比各格式时，管线同时保留量化前的RGB帧，每帧仍只量化一次
+        rgb_frames = [] if settings.get('compare_formats') else None
+        frames, durations, time_stats = process_video(input_path, settings, rgb_frames)
+        if rgb_frames is not None:
+            time_stats['format_sizes'] = compare_format_sizes(rgb_frames, frames, durations, settings)
+            if settings.get('output_format', 'gif') != 'gif':
+                frames = rgb_frames
+            rgb_frames = None
+        time_stats['save'] = save_animation(frames, durations, output_path, settings,
+                                            time_stats['frame_times']['save'])
+        time_stats['output_size'] = os.path.getsize(output_path)
+        del frames
+        
+        # 正常情况下整段只编码一次；估算偏差导致超出目标时才降一档重试
+        if (candidates is None or index == len(candidates) - 1
+                or time_stats['output_size'] <= settings['target_size_mb'] * 1024 * 1024):
+            break
+        search_stats['target_attempts'] += 1
+        index += 1
+        settings = apply_candidate(settings, candidates[index])
+    
+    time_stats['target_search'] = search_stats['target_search']
+    time_stats['target_attempts'] = search_stats['target_attempts']
+    time_stats['outputs'] = [output_path]
+    return time_stats, settings
+
+def get_peak_rss_mb():
+    """返回当前进程的峰值内存(MB)；无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS为字节
+        return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 / 1024
+    except ImportError:
+        return None
+
+def summarize_samples(samples):
+    """逐帧耗时样本的分布统计（秒）"""
+    if not samples:
+        return {'count': 0, 'p50': None, 'p95': None, 'max': None}
+    return {
+        'count': len(samples),
+        'p50': float(np.percentile(samples, 50)),
+        'p95': float(np.percentile(samples, 95)),
+        'max': float(max(samples))
+    }
+
+def build_profile(input_path, time_stats, settings, peak_rss_scope='process'):
+    """把时间记录整理为可机读的性能数据字典
+
+    peak_rss_scope说明峰值内存的统计范围：'process'为本任务独占的进程，
+    'worker'为复用的工作进程，包含之前在该进程中运行的任务。
+    """
+    frame_times = time_stats['frame_times']
+    return {
+        'input': os.path.abspath(input_path),
+        'outputs': [os.path.abspath(p) for p in time_stats.get('outputs', [])],
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'settings': {k: settings.get(k) for k in DEFAULT_SETTINGS},
+        'frames': {
+            'total': time_stats['frame_count'],
+            'decoded': time_stats['decoded_frames'],
+            'skipped': time_stats['skipped_frames'],
+            'kept': time_stats['processed_frames'],
+            'scene_cuts': time_stats['scene_cuts']
+        },
+        'stages': {key: time_stats[key] for key in (
+            'total', 'read', 'resize', 'convert', 'dynamic_framerate',
+            'vector_quant', 'color_optim', 'save', 'target_search')},
+        # 整体编码的格式没有逐帧保存耗时，不输出save，避免count为0被误读为没有编码
+        'per_frame': {stage: summarize_samples(samples)
+                      for stage, samples in frame_times.items() if stage != 'save' or samples},
+        'output_size': time_stats.get('output_size', 0),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'peak_rss_scope': peak_rss_scope
+    }
+
+def flatten_profile(profile, prefix=''):
+    """把嵌套的性能数据展开为单层字典（CSV的一行）"""
+    row = {}
+    for key, value in profile.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            row.update(flatten_profile(value, name + '.'))
+        elif isinstance(value, (list, tuple)):
+            row[name] = json.dumps(value, ensure_ascii=False)
+        else:
+            row[name] = value
+    return row
+
+def resolve_profile_path(settings, output_path):
+    """'auto'时性能数据保存在输出文件旁，否则使用指定路径；未启用时返回None"""
+    profile_output = settings.get('profile_output')
+    if not profile_output:
+        return None
+    if profile_output == 'auto':
+        return os.path.splitext(output_path)[0] + '.profile.json'
+    return profile_output
+
+def write_profile(profiles, profile_path):
+    """写出性能数据：.csv每个任务一行，其他扩展名写JSON（单个任务为对象，多个为数组）"""
+    if profile_path.lower().endswith('.csv'):
+        rows = [flatten_profile(p) for p in profiles]
+        fieldnames = list(dict.fromkeys(k for row in rows for k in row))
+        with open(profile_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(profile_path, 'w', encoding='utf-8') as f:
+            json.dump(profiles[0] if len(profiles) == 1 else profiles, f, ensure_ascii=False, indent=2)
+
 def wait_for_user():
     """等待用户按键（仅用于交互模式）"""
     print("\n处理已完成，按回车键退出程序...")
@@ -399,21 +1469,41 @@ def wait_for_user():
         msvcrt.getch()
 
 def main():
-    # 拖放模式（使用默认设置）
+    # 命令行/拖放模式（使用默认设置）
     if len(sys.argv) > 1:
-        input_path = sys.argv[1]
+        args = parse_args(sys.argv[1:])
+        settings = {**DEFAULT_SETTINGS, 'memory_limit_mb': args.memory_limit,
+                    'target_size_mb': args.target_size, 'output_format': args.format,
+                    'compare_formats': args.compare_formats, 'decode_backend': args.decoder,
+                    'start_time': args.start, 'end_time': args.end, 'crop': args.crop,
+                    'segments': args.segments, 'profile_output': args.profile,
+                    'delta_tolerance': args.delta_tolerance}
+        video_files = collect_video_files(args.paths)
+        
+        # 拖入多个文件或文件夹时进入批量模式
+        if len(args.paths) > 1 or os.path.isdir(args.paths[0].strip('"')):
+            settings['collision_policy'] = args.on_exist or 'rename'
+            if not video_files:
+                print("❌ 未找到视频文件")
+                return
+            batch_convert(video_files, settings, args.jobs)
+            return
+        
+        settings['collision_policy'] = args.on_exist or 'ask'
+        input_path = args.paths[0]
         try:
-            # 生成输出路径（处理重名文件）
-            output_path = generate_output_path(input_path, DEFAULT_SETTINGS)
+            # 生成输出路径（处理重名文件，多段时逐段处理）
+            output_path, segment_paths = plan_output_paths(input_path, settings)
             if output_path is None:
                 return  # 用户取消，静默退出
             
-            # 处理视频
-            start_time = time.perf_counter()
-            frames, duration, time_stats = process_video(input_path, DEFAULT_SETTINGS)
+            # 处理视频并保存GIF
+            time_stats, used_settings = convert_video(input_path, output_path, settings, segment_paths)
             
-            # 保存GIF
-            save_time = save_gif(frames, duration, output_path)
+            # 拖放模式只在启用时静默写出性能数据
+            profile_path = resolve_profile_path(settings, output_path)
+            if profile_path:
+                write_profile([build_profile(input_path, time_stats, used_settings)], profile_path)
             
             # 拖放模式静默退出，不显示任何信息
             return
@@ -426,38 +1516,48 @@ def main():
     if not settings:
         return
     
-    input_path = filedialog.askopenfilename(
-        title="选择MP4文件",
-        filetypes=[("MP4视频", "*.mp4"), ("所有文件", "*.*")]
+    input_paths = filedialog.askopenfilenames(
+        title="选择视频文件（可多选）",
+        filetypes=[("视频文件", " ".join(f"*{ext}" for ext in VIDEO_EXTENSIONS)), ("所有文件", "*.*")]
     )
-    if not input_path:
+    if not input_paths:
         return
     
+    # 合并设置
+    combined_settings = {**DEFAULT_SETTINGS, **settings}
+    
+    # 多选时走批量模式；与命令行批量一样自动重命名，不逐个弹窗
+    if len(input_paths) > 1:
+        combined_settings['collision_policy'] = 'rename'
+        batch_convert(list(input_paths), combined_settings)
+        wait_for_user()
+        return
+    input_path = input_paths[0]
+    
     try:
-        # 合并设置
-        combined_settings = {**DEFAULT_SETTINGS, **settings}
-        
-        # 生成输出路径（处理重名文件）
-        output_path = generate_output_path(input_path, combined_settings)
+        # 生成输出路径（处理重名文件，多段时逐段处理）
+        output_path, segment_paths = plan_output_paths(input_path, combined_settings)
         if output_path is None:
             print("操作已取消")
             wait_for_user()
             return
         
-        # 处理视频
-        frames, duration, time_stats = process_video(input_path, combined_settings)
-        
-        # 保存GIF
-        save_time = save_gif(frames, duration, output_path)
-        time_stats['save'] = save_time
+        # 处理视频并保存GIF
+        time_stats, used_settings = convert_video(input_path, output_path, combined_settings, segment_paths)
         
         # 在控制台显示成功信息
         total_time = time_stats['total'] + time_stats['save']
-        print_success_message(output_path, total_time)
+        print_success_message("\n          ".join(time_stats['outputs']), total_time)
         
         # 在控制台显示时间报告
         if combined_settings['time_logging']:
-            print_time_report(time_stats, combined_settings)
+            print_time_report(time_stats, used_settings)
+        
+        # 导出性能数据
+        profile_path = resolve_profile_path(combined_settings, output_path)
+        if profile_path:
+            write_profile([build_profile(input_path, time_stats, used_settings)], profile_path)
+            print(f"性能数据已保存到: {profile_path}")
             
         # 等待用户按键
         wait_for_user()
@@ -0,0 +1,413 @@
+# 视频转GIF基准测试.py
+"""
+视频转GIF 基准测试与回归检查
+
+在本地合成几段确定性的测试视频（移动渐变、滚动文字、静态界面+光标），
+按设置矩阵逐一转换，记录耗时、文件大小和画质(PSNR/SSIM)，
+并与保存的基准结果比较，出现回归时以非零状态码退出。
+
+用法:
+    python 视频转GIF基准测试.py                  # 运行并与基准比较
+    python 视频转GIF基准测试.py --save-baseline  # 运行并保存为新的基准
+    python 视频转GIF基准测试.py --configs default,webp --videos static_ui
+
+每段视频还会做差分帧GIF往返检查：解码输出后逐帧与编码前的帧比较，
+容差为0时必须完全一致，否则误差不得超过容差。
+转换时用计数函数替换转换器中的cv2.resize、cv2.cvtColor和quantize_frame，
+检查每个保留帧的缩放、颜色转换、量化都恰好执行一次。
+"""
+
+import io
+import os
+import sys
+import json
+import argparse
+import tempfile
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+import 视频转GIF as converter
+
+# -------------------- 配置 --------------------
+# 合成视频参数
+VIDEO_WIDTH = 480
+VIDEO_HEIGHT = 270
+VIDEO_FPS = 30
+VIDEO_FRAMES = 60
+
+# 要比较的设置矩阵（在默认设置基础上覆盖）
+BENCHMARK_CONFIGS = {
+    'default': {},
+    'color_optim': {'color_optim': True},
+    'vq_efficiency': {'vector_quantization': True, 'vector_colors': 32, 'processing_order': 'efficiency'},
+    'vq_quality': {'vector_quantization': True, 'vector_colors': 32, 'processing_order': 'quality'},
+    'no_delta': {'delta_encoding': False},
+    'frame_step_2': {'frame_step': 2},
+    'dynamic_framerate': {'dynamic_framerate': True},
+    'webp': {'output_format': 'webp'},
+}
+
+# 回归阈值：相对基准允许的变化
+TIME_TOLERANCE = 0.5  # 耗时最多慢50%（计时噪声较大）
+SIZE_TOLERANCE = 0.05  # 文件最多大5%
+PSNR_TOLERANCE = 0.5  # PSNR最多低0.5dB
+SSIM_TOLERANCE = 0.01  # SSIM最多低0.01
+
+# 不依赖基准的画质下限，低于此值视为输出损坏（移动渐变在32色下本身就只有十几dB）
+MIN_PSNR = 8.0
+MIN_SSIM = 0.3
+
+# 差分帧往返检查使用的容差（0为无损，另取一个有损值检查误差上限）
+ROUNDTRIP_TOLERANCES = [0, 6]
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '视频转GIF基准测试_baseline.json')
+# ----------------------------------------------
+
+
+def synth_moving_gradient(i):
+    """水平、垂直两个方向同时移动的彩色渐变"""
+    xx, yy = np.meshgrid(np.arange(VIDEO_WIDTH), np.arange(VIDEO_HEIGHT))
+    frame = np.empty((VIDEO_HEIGHT, VIDEO_WIDTH, 3), np.uint8)
+    frame[..., 0] = (xx + i * 4) % 256
+    frame[..., 1] = (yy * 2 + i * 3) % 256
+    frame[..., 2] = ((xx + yy) // 2 + i * 2) % 256
+    return frame
+
+
+def synth_text_scroll(i):
+    """白底黑字向上滚动的文本"""
+    frame = np.full((VIDEO_HEIGHT, VIDEO_WIDTH, 3), 255, np.uint8)
+    line_height = 24
+    offset = i * 3
+    first_line = offset // line_height
+    for n in range(first_line, first_line + VIDEO_HEIGHT // line_height + 2):
+        y = n * line_height - offset + line_height
+        cv2.putText(frame, f"{n:03d} comfy_text_block masterpiece, best quality",
+                    (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (20, 20, 20), 1, cv2.LINE_AA)
+    return frame
+
+
+def synth_static_ui(i):
+    """静态界面截图，只有鼠标光标移动、输入光标闪烁"""
+    frame = np.full((VIDEO_HEIGHT, VIDEO_WIDTH, 3), 235, np.uint8)
+    cv2.rectangle(frame, (0, 0), (VIDEO_WIDTH, 30), (90, 60, 40), -1)
+    cv2.putText(frame, "ZML Image Tools", (10, 21), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
+    cv2.rectangle(frame, (0, 30), (110, VIDEO_HEIGHT), (210, 210, 210), -1)
+    for n in range(6):
+        cv2.putText(frame, f"Menu {n + 1}", (12, 60 + n * 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (40, 40, 40), 1, cv2.LINE_AA)
+    cv2.rectangle(frame, (130, 60), (460, 90), (255, 255, 255), -1)
+    cv2.rectangle(frame, (130, 60), (460, 90), (150, 150, 150), 1)
+    if (i // 8) % 2 == 0:
+        cv2.line(frame, (140, 66), (140, 84), (0, 0, 0), 1)
+    # 鼠标光标沿固定路径移动
+    cx = 150 + int(120 * np.cos(i / 10))
+    cy = 170 + int(60 * np.sin(i / 7))
+    cursor = np.array([[cx, cy], [cx, cy + 18], [cx + 5, cy + 13], [cx + 12, cy + 13]], np.int32)
+    cv2.fillPoly(frame, [cursor], (0, 0, 0))
+    return frame
+
+
+SYNTHETIC_VIDEOS = {
+    'moving_gradient': synth_moving_gradient,
+    'text_scroll': synth_text_scroll,
+    'static_ui': synth_static_ui,
+}
+
+
+def synthesize_video(name, folder):
+    """生成测试视频（MJPG编码，各平台的OpenCV都能读写）"""
+    path = os.path.join(folder, f"{name}.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), VIDEO_FPS, (VIDEO_WIDTH, VIDEO_HEIGHT))
+    if not writer.isOpened():
+        raise RuntimeError("无法创建测试视频，请检查OpenCV的视频编码支持")
+    for i in range(VIDEO_FRAMES):
+        writer.write(SYNTHETIC_VIDEOS[name](i))
+    writer.release()
+    return path
+
+
+def read_source_frames(video_path):
+    """读取测试视频的全部帧（RGB），作为画质比较的参考"""
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
+def read_output_frames(output_path):
+    """读取输出动图（路径或文件对象）的每一帧 (RGB数组, 开始时间ms)"""
+    frames = []
+    start_ms = 0
+    with Image.open(output_path) as im:
+        for frame in ImageSequence.Iterator(im):
+            frames.append((np.asarray(frame.convert('RGB')), start_ms))
+            start_ms += frame.info.get('duration', 0) or 0
+    return frames
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return 100.0 if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def ssim(a, b):
+    """灰度图上的标准SSIM（11x11高斯窗口）"""
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def score_quality(source_frames, output_frames):
+    """按播放时间线比较：每个源帧与该时刻实际显示的输出帧比较，跳帧和时长错误同样会扣分"""
+    frame_ms = 1000 / VIDEO_FPS
+    height, width = output_frames[0][0].shape[:2]
+    psnr_values, ssim_values = [], []
+    shown = 0
+    for i, source in enumerate(source_frames):
+        t = i * frame_ms
+        while shown + 1 < len(output_frames) and output_frames[shown + 1][1] <= t:
+            shown += 1
+        reference = cv2.resize(source, (width, height), interpolation=cv2.INTER_AREA)
+        psnr_values.append(psnr(reference, output_frames[shown][0]))
+        ssim_values.append(ssim(reference, output_frames[shown][0]))
+    return float(np.mean(psnr_values)), float(np.mean(ssim_values))
+
+
+class StageCounter:
+    """在转换期间替换转换器用到的cv2.resize、cv2.cvtColor和quantize_frame，统计逐帧管线各阶段的调用次数
+
+    运动检测缩略图也会调用resize/cvtColor，所以只统计缩放到输出尺寸的resize和BGR->RGB的cvtColor；
+    保留帧数另由save_animation收到的帧数得出，不依赖转换器自己的计数。
+    """
+
+    def __init__(self, scaled_size):
+        self.scaled_size = scaled_size
+        self.calls = {'resize': 0, 'convert': 0, 'quantize': 0}
+        self.kept_frames = 0
+
+    def __enter__(self):
+        cv2_module = converter.cv2
+        self.originals = (cv2_module.resize, cv2_module.cvtColor,
+                          converter.quantize_frame, converter.save_animation)
+        resize, cvt_color, quantize_frame, save_animation = self.originals
+
+        def counting_resize(src, dsize, *args, **kwargs):
+            if tuple(dsize) == self.scaled_size:
+                self.calls['resize'] += 1
+            return resize(src, dsize, *args, **kwargs)
+
+        def counting_cvt_color(src, code, *args, **kwargs):
+            if code == cv2_module.COLOR_BGR2RGB:
+                self.calls['convert'] += 1
+            return cvt_color(src, code, *args, **kwargs)
+
+        def counting_quantize_frame(*args, **kwargs):
+            self.calls['quantize'] += 1
+            return quantize_frame(*args, **kwargs)
+
+        def counting_save_animation(frames, *args, **kwargs):
+            self.kept_frames += len(frames)
+            return save_animation(frames, *args, **kwargs)
+
+        cv2_module.resize = counting_resize
+        cv2_module.cvtColor = counting_cvt_color
+        converter.quantize_frame = counting_quantize_frame
+        converter.save_animation = counting_save_animation
+        return self
+
+    def __exit__(self, *exc_info):
+        converter.cv2.resize, converter.cv2.cvtColor, converter.quantize_frame, converter.save_animation = self.originals
+        return False
+
+    def check(self, settings, source_size):
+        """返回与保留帧数不一致的阶段描述列表"""
+        expected = {
+            'resize': self.kept_frames if self.scaled_size != source_size else 0,
+            'convert': self.kept_frames,
+            'quantize': self.kept_frames if converter.needs_palette(settings) else 0,
+        }
+        return [f"阶段 {stage} 执行了 {self.calls[stage]} 次，应为 {expected[stage]} 次（保留 {self.kept_frames} 帧）"
+                for stage in expected if self.calls[stage] != expected[stage]]
+
+
+def run_case(video_path, source_frames, config, output_dir, repeat):
+    """运行一个 (视频, 设置) 组合，返回测量结果"""
+    settings = {**converter.DEFAULT_SETTINGS, **config, 'collision_policy': 'overwrite'}
+    output_path = converter.generate_output_path(video_path, settings)
+    output_path = os.path.join(output_dir, os.path.basename(output_path))
+
+    source_size = (VIDEO_WIDTH, VIDEO_HEIGHT)
+    scaled_size = converter.compute_scaled_size(VIDEO_WIDTH, VIDEO_HEIGHT, settings['scale_factor'])
+    best_time = None
+    for _ in range(repeat):
+        with StageCounter(scaled_size) as counter:
+            time_stats, _ = converter.convert_video(video_path, output_path, settings)
+        # 每个保留帧的缩放/颜色转换/量化都只能执行一次
+        problems = counter.check(settings, source_size)
+        if problems:
+            raise AssertionError("; ".join(problems))
+        elapsed = time_stats['total'] + time_stats['save']
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+
+    quality_psnr, quality_ssim = score_quality(source_frames, read_output_frames(output_path))
+    return {
+        'time': best_time,
+        'size': os.path.getsize(output_path),
+        'psnr': quality_psnr,
+        'ssim': quality_ssim,
+        'kept_frames': time_stats['processed_frames'],
+        'stages': {key: time_stats[key] for key in ('read', 'resize', 'convert', 'vector_quant', 'color_optim', 'save')}
+    }
+
+
+def check_delta_roundtrip(video_path, tolerance):
+    """差分帧GIF往返检查：编码到内存再解码，按播放时间线逐帧与编码前的调色板帧比较
+
+    完全相同的帧在编码时会并入上一帧的时长，所以按时间线对齐而不是按帧序号。
+    返回 (最大通道误差, 问题描述或None)。
+    """
+    settings = {**converter.DEFAULT_SETTINGS, 'delta_encoding': True, 'delta_tolerance': tolerance}
+    frames, durations, _ = converter.process_video(video_path, settings)
+    buffer = io.BytesIO()
+    converter.write_delta_gif(frames, durations, buffer, tolerance)
+    buffer.seek(0)
+    decoded = read_output_frames(buffer)
+
+    max_error = 0
+    shown = 0
+    start_ms = 0
+    for frame, duration in zip(frames, durations):
+        while shown + 1 < len(decoded) and decoded[shown + 1][1] <= start_ms:
+            shown += 1
+        expected = np.asarray(frame.convert('RGB')).astype(np.int16)
+        max_error = max(max_error, int(np.abs(expected - decoded[shown][0]).max()))
+        start_ms += duration
+
+    if max_error > tolerance:
+        return max_error, f"差分帧往返(容差{tolerance}): 最大误差 {max_error} 超过容差"
+    return max_error, None
+
+
+def check_regressions(results, baseline):
+    """与基准比较，返回回归描述列表；同时检查不依赖基准的画质下限"""
+    problems = []
+    for key, result in results.items():
+        if result['psnr'] < MIN_PSNR:
+            problems.append(f"{key}: PSNR {result['psnr']:.2f}dB 低于下限 {MIN_PSNR}dB")
+        if result['ssim'] < MIN_SSIM:
+            problems.append(f"{key}: SSIM {result['ssim']:.3f} 低于下限 {MIN_SSIM}")
+
+        base = baseline.get(key)
+        if not base:
+            continue
+        if result['time'] > base['time'] * (1 + TIME_TOLERANCE):
+            problems.append(f"{key}: 耗时 {converter.format_time(result['time'])} "
+                            f"超过基准 {converter.format_time(base['time'])} 的 {TIME_TOLERANCE:.0%} 容差")
+        if result['size'] > base['size'] * (1 + SIZE_TOLERANCE):
+            problems.append(f"{key}: 大小 {result['size']} 字节超过基准 {base['size']} 字节的 {SIZE_TOLERANCE:.0%} 容差")
+        if result['psnr'] < base['psnr'] - PSNR_TOLERANCE:
+            problems.append(f"{key}: PSNR {result['psnr']:.2f}dB 比基准 {base['psnr']:.2f}dB 低")
+        if result['ssim'] < base['ssim'] - SSIM_TOLERANCE:
+            problems.append(f"{key}: SSIM {result['ssim']:.3f} 比基准 {base['ssim']:.3f} 低")
+    return problems
+
+
+def print_results_table(results, baseline):
+    """在控制台打印结果表格，有基准时附带相对变化"""
+    print(f"\n{'视频/设置':<34}{'耗时':>10}{'大小(KB)':>11}{'PSNR':>8}{'SSIM':>8}{'保留帧':>7}  相对基准")
+    print("-" * 100)
+    for key, r in results.items():
+        delta = ""
+        base = baseline.get(key)
+        if base:
+            delta = (f"时间 {(r['time'] / base['time'] - 1) * 100:+.0f}%  "
+                     f"大小 {(r['size'] / base['size'] - 1) * 100:+.1f}%  "
+                     f"PSNR {r['psnr'] - base['psnr']:+.2f}")
+        print(f"{key:<34}{converter.format_time(r['time']):>10}{r['size'] / 1024:>11.1f}"
+              f"{r['psnr']:>8.2f}{r['ssim']:>8.3f}{r['kept_frames']:>7}  {delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='视频转GIF 基准测试与回归检查')
+    parser.add_argument('--configs', default=','.join(BENCHMARK_CONFIGS),
+                        help='要运行的设置，逗号分隔（默认全部）')
+    parser.add_argument('--videos', default=','.join(SYNTHETIC_VIDEOS),
+                        help='要使用的合成视频，逗号分隔（默认全部）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个组合重复次数，耗时取最小值（默认3）')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基准结果文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为新的基准')
+    parser.add_argument('--output', help='把本次结果另存为JSON')
+    args = parser.parse_args()
+
+    configs = [c.strip() for c in args.configs.split(',') if c.strip()]
+    videos = [v.strip() for v in args.videos.split(',') if v.strip()]
+    for name in configs:
+        if name not in BENCHMARK_CONFIGS:
+            parser.error(f"未知设置: {name}（可选: {', '.join(BENCHMARK_CONFIGS)}）")
+    for name in videos:
+        if name not in SYNTHETIC_VIDEOS:
+            parser.error(f"未知视频: {name}（可选: {', '.join(SYNTHETIC_VIDEOS)}）")
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = {}
+    roundtrip_problems = []
+    with tempfile.TemporaryDirectory(prefix='gif_bench_') as work_dir:
+        for video in videos:
+            video_path = synthesize_video(video, work_dir)
+            source_frames = read_source_frames(video_path)
+            for tolerance in ROUNDTRIP_TOLERANCES:
+                max_error, problem = check_delta_roundtrip(video_path, tolerance)
+                print(f"差分帧往返 {video} (容差{tolerance}): 最大误差 {max_error}")
+                if problem:
+                    roundtrip_problems.append(f"{video}: {problem}")
+            for config in configs:
+                key = f"{video}/{config}"
+                print(f"运行 {key} ...")
+                results[key] = run_case(video_path, source_frames, BENCHMARK_CONFIGS[config], work_dir, args.repeat)
+
+    print_results_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 基准已保存到: {args.baseline}")
+        return 0
+
+    problems = check_regressions(results, baseline)
+    problems += roundtrip_problems
+    print("=" * 100)
+    if not baseline:
+        print("ℹ️ 未找到基准文件，仅检查了画质下限。使用 --save-baseline 保存基准。")
+    if problems:
+        print(f"❌ 发现 {len(problems)} 项回归:")
+        for problem in problems:
+            print(f"   - {problem}")
+        return 1
+    print("✅ 未发现回归")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())